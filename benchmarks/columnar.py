@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+from contextlib import closing
+
+from lib import logging, sql_schema
+from lib.columnar import ColumnarStore
+from settings import DATASET, DATASET_DB, COLUMNAR_DIR
+
+
+def timed(func, repeat=1):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started_at) / repeat, result
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
+
+    bboxes_table = DATASET['bboxes'][args.set]['table']
+    labels_table = DATASET['labels'][args.set]['table']
+    results = {'set': args.set}
+
+    with closing(sqlite3.connect(DATASET_DB)) as conn:
+        schema = sql_schema(conn)
+        open_time, store = timed(lambda: ColumnarStore(os.path.join(COLUMNAR_DIR, args.set)))
+        results['columnar_open'] = open_time
+        results['boxes'] = len(store)
+
+        # Full scan: positive boxes per class
+        results['sqlite_class_counts'], _ = timed(
+            lambda: conn.execute(schema.select_class_box_counts(bboxes_table, labels_table)).fetchall()
+        )
+        results['columnar_class_counts'], _ = timed(lambda: store.class_counts(store.positive_mask()))
+
+        # Per-image lookups
+        image_ids = [image_id.decode() for image_id in store.image_ids]
+        sample = random.Random(0).sample(image_ids, min(args.lookups, len(image_ids)))
+
+        def sqlite_lookups():
+            for image_id in sample:
+                conn.execute(*schema.select_labels(bboxes_table, labels_table, image_id)).fetchall()
+
+        def columnar_lookups():
+            for image_id in sample:
+                rows = store.image_rows(image_id)
+                mask = store.verified[rows] == 1
+                store.boxes[rows][mask]
+
+        results['sqlite_lookups'], _ = timed(sqlite_lookups)
+        results['columnar_lookups'], _ = timed(columnar_lookups)
+        results['lookups'] = len(sample)
+
+    for key, value in results.items():
+        logger.info(f'{key}: {value}')
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--set',
+        type=str,
+        default='train',
+        choices=['train', 'validation', 'test'],
+        help='Set of data (train, validation or test)',
+    )
+    parser.add_argument(
+        '--lookups',
+        type=int,
+        default=1000,
+        help='Number of random per-image lookups',
+    )
+    parser.add_argument(
+        '-l', '--loglevel',
+        type=str.upper,
+        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+        default='INFO',
+    )
+
+    main(parser.parse_args())
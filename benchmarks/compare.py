@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+import argparse
+import json
+import sys
+
+# Results that are sizes or counts rather than timings
+COUNTS = {
+    'boxes',
+    'db_size',
+    'images',
+    'labels',
+    'select_labels_lookups',
+    'downloaded_images',
+    'label_files',
+    'preview_files',
+}
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f'{prefix}{key}.')
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f'{prefix}{key}', value
+
+
+def is_timing(name):
+    keys = name.split('.')
+    return keys[0] not in COUNTS and keys[-1] not in COUNTS
+
+
+def main(args):
+    with open(args.base, 'r') as f:
+        base = json.load(f)
+    with open(args.new, 'r') as f:
+        new = json.load(f)
+
+    print(f'base {base.get("commit")}  new {new.get("commit")}')
+    base_results = dict(flatten(base['results']))
+    regressions = 0
+    for name, value in flatten(new['results']):
+        if name not in base_results:
+            continue
+        base_value = base_results[name]
+        ratio = value / base_value if base_value else float('inf') if value else 1.
+        flag = ''
+        if is_timing(name) and ratio > args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f'{name:50s} {base_value:14.4f} {value:14.4f} {ratio:7.2f}x{flag}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'base',
+        type=str,
+        help='JSON results of benchmarks.suite to compare against',
+    )
+    parser.add_argument(
+        'new',
+        type=str,
+        help='JSON results of benchmarks.suite to compare',
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=1.2,
+        help='Ratio of new to base timings reported as a regression',
+    )
+
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from contextlib import closing
+
+from lib import logging, SCHEMAS, register_functions
+from lib.importer import set_import_pragmas, import_table, create_indexes
+from settings import DATASET
+
+
+def timed(func, repeat=1):
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return (time.perf_counter() - started_at) / repeat, result
+
+
+def benchmark(schema, path, args, logger):
+    refs = {
+        'classes': DATASET['metadata']['classes'],
+        'bboxes': DATASET['bboxes'][args.set],
+        'labels': DATASET['labels'][args.set],
+        'images': DATASET['images'][args.set],
+    }
+    results = {}
+
+    with closing(sqlite3.connect(path)) as conn:
+        set_import_pragmas(conn)
+        register_functions(conn)
+
+        def import_all():
+            for kind, ref in refs.items():
+                import_table(conn, kind, ref['table'], ref['local_path'], schema=schema)
+                create_indexes(conn, kind, ref['table'], schema=schema)
+
+        results['import'], _ = timed(import_all)
+        conn.execute('pragma wal_checkpoint(truncate)')
+        results['db_size'] = os.path.getsize(path)
+
+        query, params = schema.select_images(refs['bboxes']['table'], refs['labels']['table'], refs['images']['table'])
+        results['select_images'], rows = timed(lambda: conn.execute(query, params).fetchall())
+        results['images'] = len(rows)
+
+        query, params = schema.select_labels_by_image(refs['bboxes']['table'], refs['labels']['table'])
+        results['select_labels_by_image'], _ = timed(lambda: conn.execute(query, params).fetchall())
+
+        sample = random.Random(0).sample([row[0] for row in rows], min(args.lookups, len(rows)))
+
+        def lookups():
+            for image_id in sample:
+                conn.execute(*schema.select_labels(refs['bboxes']['table'], refs['labels']['table'], image_id)).fetchall()
+
+        results['select_labels'], _ = timed(lookups)
+        results['lookups'] = len(sample)
+
+    logger.info(f'{schema.__name__}: {results}')
+    return results
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
+
+    results = {'set': args.set}
+    with tempfile.TemporaryDirectory(dir=args.tmp_dir) as tmp_dir:
+        for name, schema in SCHEMAS.items():
+            results[name] = benchmark(schema, os.path.join(tmp_dir, f'{name}.sqlite'), args, logger)
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--set',
+        type=str,
+        default='validation',
+        choices=['train', 'validation', 'test'],
+        help='Set of data (train, validation or test)',
+    )
+    parser.add_argument(
+        '--lookups',
+        type=int,
+        default=1000,
+        help='Number of random per-image label lookups',
+    )
+    parser.add_argument(
+        '--tmp-dir',
+        type=str,
+        default=None,
+        help='Directory for the temporary DBs (defaults to the system temp directory)',
+    )
+    parser.add_argument(
+        '-l', '--loglevel',
+        type=str.upper,
+        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+        default='INFO',
+    )
+
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+import argparse
+import http.server
+import re
+import threading
+import time
+
+from benchmarks.synthetic import IMAGE_VARIANTS, image_variant, is_unavailable, make_image
+from lib import logging
+
+IMAGE_PATH = re.compile(r'^/(thumb|org)/([0-9a-f]{16})\.jpg$')
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the synthetic images of benchmarks.synthetic like the Open Images hosts."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def route(self):
+        match = IMAGE_PATH.match(self.path)
+        if not match:
+            return 404, b''
+        image_type, image_id = match.groups()
+        if is_unavailable(image_id, image_type):
+            return 302, b''
+        return 200, self.server.images[image_variant(image_id)]
+
+    def respond(self, with_body):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        status_code, body = self.route()
+        self.send_response(status_code)
+        if status_code == 302:
+            self.send_header('Location', f'http://{self.headers["Host"]}/removed.png')
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.respond(False)
+
+    def do_GET(self):
+        self.respond(True)
+
+
+class StubServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.):
+        super().__init__((host, port), StubHandler)
+        self.latency = latency
+        self.images = [make_image(variant) for variant in range(IMAGE_VARIANTS)]
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
+
+    server = StubServer(args.host, args.port, args.latency)
+    logger.info(f'Serving synthetic images on {server.base_url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--host',
+        type=str,
+        default='127.0.0.1',
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=8000,
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.,
+        help='Seconds added to every response',
+    )
+    parser.add_argument(
+        '-l', '--loglevel',
+        type=str.upper,
+        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+        default='INFO',
+    )
+
+    main(parser.parse_args())
@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import closing
+
+from benchmarks.stub import StubServer
+from benchmarks.synthetic import generate
+from lib import logging, sql_schema, register_functions
+from settings import DATASET
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def timed(func):
+    started_at = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started_at, result
+
+
+def run_script(base_dir, script, *args):
+    # Scripts read their paths from settings, which follows OPEN_IMAGES_BASE_DIR
+    env = dict(os.environ, OPEN_IMAGES_BASE_DIR=base_dir, PYTHONPATH=REPO_DIR)
+    elapsed, _ = timed(lambda: subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, script), *args, '-l', 'WARNING'],
+        env=env,
+        cwd=base_dir,
+        check=True,
+    ))
+    return elapsed
+
+
+def count_files(path, ext=None):
+    if not os.path.isdir(path):
+        return 0
+    return sum(1 for name in os.listdir(path) if ext is None or name.endswith(ext))
+
+
+def benchmark_queries(db_path, split, lookups):
+    bboxes_table = DATASET['bboxes'][split]['table']
+    labels_table = DATASET['labels'][split]['table']
+    images_table = DATASET['images'][split]['table']
+    results = {}
+
+    with closing(sqlite3.connect(db_path)) as conn:
+        register_functions(conn)
+        schema = sql_schema(conn)
+
+        query, params = schema.select_images(bboxes_table, labels_table, images_table)
+        results['select_images'], rows = timed(lambda: conn.execute(query, params).fetchall())
+        results['images'] = len(rows)
+
+        query, params = schema.select_images(
+            bboxes_table, labels_table, images_table, class_names=['Class 0'], limit=1000
+        )
+        results['select_images_class_limit'], _ = timed(lambda: conn.execute(query, params).fetchall())
+
+        query, params = schema.select_images(bboxes_table, labels_table, images_table, shard=(0, 8))
+        results['select_images_shard'], _ = timed(lambda: conn.execute(query, params).fetchall())
+
+        query, params = schema.select_labels_by_image(bboxes_table, labels_table)
+        results['select_labels_by_image'], labels = timed(lambda: conn.execute(query, params).fetchall())
+        results['labels'] = len(labels)
+
+        sample = random.Random(0).sample([row[0] for row in rows], min(lookups, len(rows)))
+
+        def select_labels():
+            for image_id in sample:
+                conn.execute(*schema.select_labels(bboxes_table, labels_table, image_id)).fetchall()
+
+        results['select_labels'], _ = timed(select_labels)
+        results['select_labels_lookups'] = len(sample)
+    return results
+
+
+def benchmark_export(base_dir, args):
+    images_dir = os.path.join(base_dir, 'images', args.export_set)
+    labels_dir = os.path.join(base_dir, 'labels', args.export_set)
+    previews_dir = os.path.join(base_dir, 'previews', args.export_set)
+    common = ['--set', args.export_set, '--limit', str(args.images), '--concurrency', str(args.concurrency)]
+    results = {}
+
+    # Online: fetch from the stub server, then write labels
+    results['download'] = run_script(base_dir, 'download_images.py', *common, '--without-preview')
+    results['downloaded_images'] = count_files(images_dir)
+
+    # Offline: the images exist, so only labels (and previews) are generated
+    shutil.rmtree(labels_dir)
+    results['labels'] = run_script(base_dir, 'download_images.py', *common, '--without-preview')
+    results['label_files'] = count_files(labels_dir, '.txt')
+
+    shutil.rmtree(labels_dir)
+    results['labels_previews'] = run_script(base_dir, 'download_images.py', *common)
+    results['preview_files'] = count_files(previews_dir)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(base_dir, args, logger):
+    stub = StubServer(port=args.port, latency=args.latency).start()
+    results = {}
+
+    logger.info(f'Generating {args.boxes} train boxes in {base_dir}')
+    results['generate'], counts = timed(
+        lambda: generate(os.path.join(base_dir, 'dataset'), args.boxes, stub.base_url, seed=args.seed)
+    )
+    results['boxes'] = counts
+
+    db_path = os.path.join(base_dir, 'dataset.sqlite')
+    results['schemas'] = {}
+    for schema in args.schemas:
+        logger.info(f'Importing with the {schema} schema')
+        schema_results = {
+            'import': run_script(
+                base_dir, 'import_dataset.py', '--force', '--schema', schema, '--workers', str(args.workers)
+            ),
+            'db_size': os.path.getsize(db_path),
+        }
+        logger.info(f'Querying the {schema} schema')
+        schema_results.update(benchmark_queries(db_path, args.query_set, args.lookups))
+        results['schemas'][schema] = schema_results
+
+    logger.info(f'Exporting {args.images} images of {args.export_set}')
+    results['export'] = benchmark_export(base_dir, args)
+
+    stub.shutdown()
+    return results
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
+
+    report = {
+        'commit': git_commit(),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'params': {key: value for key, value in vars(args).items() if key not in ('output', 'work_dir', 'loglevel')},
+    }
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+        report['results'] = run(os.path.realpath(args.work_dir), args, logger)
+    else:
+        with tempfile.TemporaryDirectory() as base_dir:
+            report['results'] = run(base_dir, args, logger)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        logger.info(f'Wrote {args.output}')
+    print(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--boxes',
+        type=int,
+        default=10000,
+        help='Number of synthetic train boxes (e.g. 10000 to 15000000)',
+    )
+    parser.add_argument(
+        '--schemas',
+        type=str,
+        nargs='+',
+        choices=['text', 'compact'],
+        default=['text', 'compact'],
+        help='Schemas to import and query (the last one is used for the export)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of import_dataset.py worker processes',
+    )
+    parser.add_argument(
+        '--query-set',
+        type=str,
+        default='train',
+        choices=['train', 'validation', 'test'],
+        help='Set of data to query',
+    )
+    parser.add_argument(
+        '--lookups',
+        type=int,
+        default=1000,
+        help='Number of random per-image label lookups',
+    )
+    parser.add_argument(
+        '--export-set',
+        type=str,
+        default='validation',
+        choices=['train', 'validation', 'test'],
+        help='Set of data to export with download_images.py',
+    )
+    parser.add_argument(
+        '--images',
+        type=int,
+        default=500,
+        help='Number of images to export',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        help='download_images.py --concurrency',
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.02,
+        help='Seconds the stub server adds to every response',
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=0,
+        help='Port of the stub server (0 picks a free port)',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '--work-dir',
+        type=str,
+        help='Directory for the data, DB and exported files (defaults to a temporary directory)',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        help='Path of the JSON results (also printed to stdout)',
+    )
+    parser.add_argument(
+        '-l', '--loglevel',
+        type=str.upper,
+        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+        default='INFO',
+    )
+
+    main(parser.parse_args())
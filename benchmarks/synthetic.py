@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+import argparse
+import base64
+import csv
+import hashlib
+import os
+import random
+import zlib
+
+import cv2
+import numpy as np
+
+from lib import logging
+from settings import DATASET
+
+IMAGE_VARIANTS = 16
+SPLIT_SCALE = {'train': 1, 'validation': 20, 'test': 20}
+
+
+def image_variant(image_id):
+    return zlib.crc32(image_id.encode()) % IMAGE_VARIANTS
+
+
+def make_image(variant, width=320, height=240):
+    # Noise keeps the JPEG size close to real thumbnails
+    rng = np.random.RandomState(variant)
+    img = rng.randint(0, 256, (height // 8, width // 8, 3)).astype(np.uint8)
+    img = cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC)
+    return cv2.imencode('.jpg', img)[1].tobytes()
+
+
+def is_unavailable(image_id, image_type):
+    # About 10% of thumbnails and 5% of originals are removed (302)
+    return zlib.crc32(f'{image_type}:{image_id}'.encode()) % (10 if image_type == 'thumb' else 20) == 0
+
+
+def iter_image_ids(rng, count):
+    image_id = 0
+    for _ in range(count):
+        image_id += rng.randint(1, 2 ** 64 // (count + 1))
+        yield f'{image_id:016x}'
+
+
+def write_classes(path, label_names):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for i, label_name in enumerate(label_names):
+            writer.writerow([label_name, f'Class {i}'])
+
+
+def write_split(paths, rng, label_names, boxes, base_url, subset, images):
+    bbox_f = open(paths['bboxes'], 'w', newline='')
+    labels_f = open(paths['labels'], 'w', newline='')
+    images_f = open(paths['images'], 'w', newline='')
+    with bbox_f, labels_f, images_f:
+        bbox_writer = csv.writer(bbox_f)
+        labels_writer = csv.writer(labels_f)
+        images_writer = csv.writer(images_f)
+        bbox_writer.writerow([
+            'ImageID', 'Source', 'LabelName', 'Confidence', 'XMin', 'XMax', 'YMin', 'YMax',
+            'IsOccluded', 'IsTruncated', 'IsGroupOf', 'IsDepiction', 'IsInside',
+        ])
+        labels_writer.writerow(['ImageID', 'Source', 'LabelName', 'Confidence'])
+        images_writer.writerow([
+            'ImageID', 'Subset', 'OriginalURL', 'OriginalLandingURL', 'License', 'AuthorProfileURL',
+            'Author', 'Title', 'OriginalSize', 'OriginalMD5', 'Thumbnail300KURL', 'Rotation',
+        ])
+
+        # Class frequencies are skewed like the real dataset
+        weights = [1 / (i + 1) for i in range(len(label_names))]
+        written = 0
+        for image_id in iter_image_ids(rng, max(boxes // 7, 1)):
+            count = min(rng.randint(1, 13), boxes - written)
+            if count <= 0:
+                break
+            written += count
+
+            classes = set()
+            for label_name in rng.choices(label_names, weights, k=count):
+                x_min, y_min = rng.random() * .8, rng.random() * .8
+                x_max, y_max = x_min + rng.random() * (1 - x_min), y_min + rng.random() * (1 - y_min)
+                bbox_writer.writerow([
+                    image_id, 'xclick', label_name, 1,
+                    f'{x_min:.6f}', f'{x_max:.6f}', f'{y_min:.6f}', f'{y_max:.6f}',
+                    int(rng.random() < .6), int(rng.random() < .3), int(rng.random() < .05),
+                    int(rng.random() < .05), int(rng.random() < .01),
+                ])
+                classes.add(label_name)
+            for label_name in sorted(classes):
+                labels_writer.writerow([image_id, 'verification', label_name, 1])
+            for label_name in rng.sample(label_names, 3):
+                if label_name not in classes:
+                    labels_writer.writerow([image_id, 'verification', label_name, 0])
+
+            original = images[image_variant(image_id)]
+            images_writer.writerow([
+                image_id,
+                subset,
+                f'{base_url}/org/{image_id}.jpg',
+                f'https://www.flickr.com/photos/synthetic/{image_id}',
+                'https://creativecommons.org/licenses/by/2.0/',
+                'https://www.flickr.com/people/synthetic/',
+                'Synthetic',
+                f'Image {image_id}',
+                len(original),
+                base64.b64encode(hashlib.md5(original).digest()).decode(),
+                f'{base_url}/thumb/{image_id}.jpg' if rng.random() < .97 else '',
+                rng.choice(['0', '0', '0', '90', '180', '270', '']),
+            ])
+    return written
+
+
+def generate(dataset_dir, boxes, base_url, classes=600, seed=0):
+    """Writes CSV files shaped like the Open Images V4 files of DATASET, with boxes bboxes in train."""
+    rng = random.Random(seed)
+    os.makedirs(dataset_dir, exist_ok=True)
+    images = [make_image(variant) for variant in range(IMAGE_VARIANTS)]
+    label_names = [f'/m/0{i:05x}' for i in range(classes)]
+
+    write_classes(
+        os.path.join(dataset_dir, os.path.basename(DATASET['metadata']['classes']['local_path'])),
+        label_names
+    )
+    counts = {}
+    for split, scale in SPLIT_SCALE.items():
+        paths = {
+            group: os.path.join(dataset_dir, os.path.basename(DATASET[group][split]['local_path']))
+            for group in ('bboxes', 'labels', 'images')
+        }
+        counts[split] = write_split(paths, rng, label_names, boxes // scale, base_url, split, images)
+    return counts
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
+
+    counts = generate(args.dataset_dir, args.boxes, args.base_url, classes=args.classes, seed=args.seed)
+    for split, count in counts.items():
+        logger.info(f'Generated {count} {split} boxes in {args.dataset_dir}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        'dataset_dir',
+        type=str,
+        help='Directory to write the CSV files to',
+    )
+    parser.add_argument(
+        '--boxes',
+        type=int,
+        default=10000,
+        help='Number of train boxes (validation and test get 1/20 each)',
+    )
+    parser.add_argument(
+        '--classes',
+        type=int,
+        default=600,
+        help='Number of classes',
+    )
+    parser.add_argument(
+        '--base-url',
+        type=str,
+        default='http://127.0.0.1:8000',
+        help='Base URL of the image stub server written to the images CSV files',
+    )
+    parser.add_argument(
+        '--seed',
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        '-l', '--loglevel',
+        type=str.upper,
+        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+        default='INFO',
+    )
+
+    main(parser.parse_args())
@@ -1,12 +1,74 @@
 #!/usr/bin/env python
 
 import argparse
+import base64
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
+from lib import logging, metrics, md5sum
+from lib.http import make_session
+from settings import DATASET, DATASET_DIR, DATASET_BASE_URL, HTTP_TIMEOUT
 
-from lib import logging
-from settings import DATASET, DATASET_DIR
+
+def remote_md5(response):
+    for value in response.headers.get('x-goog-hash', '').split(','):
+        algorithm, _, digest = value.strip().partition('=')
+        if algorithm == 'md5':
+            return base64.b64decode(digest).hex()
+    return None
+
+
+def download(session, url, path, chunk_size, logger, tag):
+    with metrics.timer('http_head'):
+        response = session.head(url, allow_redirects=True)
+    response.raise_for_status()
+    size = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+    md5 = remote_md5(response)
+
+    if size is not None and os.path.exists(path) and os.path.getsize(path) == size:
+        # A stale or corrupt file of the same size is downloaded again
+        if md5 is None or md5sum(path) == md5:
+            metrics.inc('files_skipped')
+            logger.info(f'{tag} {path} already exists')
+            return
+        logger.warn(f'{tag} {path} MD5 does not match {md5}')
+
+    # Resume from the partially downloaded file with an HTTP Range request
+    part_path = f'{path}.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if size is not None and offset >= size:
+        offset = 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+
+    logger.info(f'{tag} Downloading {url} -> {path}' + (f' from byte {offset}' if offset else ''))
+
+    started_at = time.monotonic()
+    downloaded = 0
+    with session.get(url, stream=True, headers=headers) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            offset = 0
+        with open(part_path, 'ab' if offset else 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                downloaded += len(chunk)
+                metrics.inc('bytes_downloaded', len(chunk))
+    elapsed = time.monotonic() - started_at
+    metrics.observe('http_get', elapsed)
+
+    if size is not None and os.path.getsize(part_path) != size:
+        raise IOError(f'{part_path} size {os.path.getsize(part_path)} does not match {size}')
+    if md5 is not None and md5sum(part_path) != md5:
+        os.remove(part_path)
+        raise IOError(f'{part_path} MD5 does not match {md5}')
+    os.replace(part_path, path)
+    metrics.inc('files_written')
+
+    logger.info(
+        f'{tag} Downloaded {downloaded / 1024 / 1024:.1f} MiB in {elapsed:.1f}s '
+        f'({downloaded / 1024 / 1024 / elapsed if elapsed else 0:.1f} MiB/s)'
+    )
 
 
 def main(args):
@@ -15,23 +77,53 @@ def main(args):
 
     os.makedirs(os.path.join(DATASET_DIR, 'org'), exist_ok=True)
 
-    for group, dataset in DATASET.items():
-        for subgroup, subdataset in dataset.items():
-            logger.info(
-                f'[{group}:{subgroup}] '
-                f'Downloading {subdataset["remote_url"]} -> {subdataset["local_path"]}'
-            )
+    session = make_session(pool_size=args.workers, timeout=HTTP_TIMEOUT)
+    with metrics.reporter('download_dataset', args, logger), ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = {}
+        for group, dataset in DATASET.items():
+            for subgroup, subdataset in dataset.items():
+                tag = f'[{group}:{subgroup}]'
+                future = executor.submit(
+                    download,
+                    session,
+                    args.base_url.rstrip('/') + subdataset['remote_url'][len(DATASET_BASE_URL):],
+                    subdataset['local_path'],
+                    args.chunk_size * 1024,
+                    logger,
+                    tag,
+                )
+                futures[future] = tag
 
-            response = requests.get(subdataset['remote_url'], stream=True)
-            with open(subdataset['local_path'], 'wb') as f:
-                for chunk in response.iter_content(chunk_size=1024):
-                    if chunk:
-                        f.write(chunk)
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                metrics.inc('files_failed')
+                logger.error(f'{futures[future]} {e}')
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
+    parser.add_argument(
+        '--base-url',
+        type=str,
+        default=DATASET_BASE_URL,
+        help='Base URL of the CSV files, e.g. a mirror (defaults to OPEN_IMAGES_BASE_URL or the Open Images bucket)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=4,
+        help='Number of files downloaded concurrently',
+    )
+    parser.add_argument(
+        '--chunk-size',
+        type=int,
+        default=1024,
+        help='Download chunk size in KiB',
+    )
+    metrics.add_arguments(parser)
     parser.add_argument(
         '-l', '--loglevel',
         type=str.upper,
@@ -3,12 +3,256 @@
 import argparse
 import cv2
 import os
-import sqlite3
 import requests
-from contextlib import closing
+import sqlite3
+from contextlib import closing, ExitStack
+from functools import partial
+
+from lib import (
+    image_cache,
+    logging,
+    metrics,
+    sql_schema,
+    make_image_name,
+    is_url_available,
+    url_availability,
+    table_exists,
+    parse_shard,
+    register_functions,
+    link_file,
+)
+from lib.bbox import to_pixels, letterbox_boxes
+from lib.classes import load_classes
+from lib.http import make_session, HostLimiter, AvailabilityCache, download_file
+from lib.image import read_image, resize_image, write_image
+from lib.labels import LabelsStream, iter_yolo_boxes
+from lib.pipeline import Stage, Pipeline
+from lib.preview import draw_boxes
+from lib.shards import ShardWriter, packed_keys
+from lib.verify import probe_image
+from settings import (
+    DATASET,
+    ANNOTATIONS,
+    IMAGES_DIR,
+    DATASET_DB,
+    LABELS_DIR,
+    BBOX_COLORS,
+    PREVIEWS_DIR,
+    URL_CACHE_DB,
+    URL_CACHE_TTL,
+    HTTP_TIMEOUT,
+    SHARDS_DIR,
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_SIZE,
+)
+
+
+def fetch_image(row, session, host_limiter, url_cache, cache, images_dir, overwrite, skip_head):
+    image_id, org_url, thumb_url, rotation, original_size, original_md5 = row
+
+    cached = None
+    failed = None
+    for image_url, image_type in ((thumb_url, 'thumb'), (org_url, 'org')):
+        if not image_url:
+            continue
+
+        image_path = os.path.join(images_dir, make_image_name(image_id, image_url))
+        if os.path.exists(image_path) and not overwrite:
+            return row, image_path, image_url, image_type, 'exists'
+
+        # Looked up once, only for images that are not in images_dir
+        if cache is not None and not overwrite:
+            cached = cached or cache.get(image_id)
+            if cached[1] == image_type:
+                link_file(cached[0], image_path, 'hardlink')
+                return row, image_path, image_url, image_type, 'cached'
+
+        try:
+            if skip_head:
+                # Decide availability from the GET response itself
+                if url_cache.get(image_url) is False:
+                    continue
+                with host_limiter(image_url):
+                    response = download_file(session, image_url, image_path, allow_redirects=False)
+                    if response.is_redirect and response.status_code != 302:
+                        # Only the 302 to the placeholder means removed, other redirects lead to the image
+                        response = download_file(session, image_url, image_path)
+                # 429s and 5xxs are not cached, so one flaky response does not mark an image removed
+                available = url_availability(response)
+                if available is not None:
+                    url_cache.set(image_url, response, available)
+            else:
+                with host_limiter(image_url):
+                    if not is_url_available(image_url, session, url_cache):
+                        continue
+                    response = download_file(session, image_url, image_path)
+        except requests.RequestException as e:
+            # Timeouts and connection errors are not cached, the next run tries again
+            logging.getLogger(__name__).debug('[%s:%s] %s failed: %r', image_id, image_type, image_url, e)
+            failed = image_url, image_type
+            continue
+
+        if response.status_code == 200:
+            if cache is not None:
+                try:
+                    cache.put_file(image_id, image_type, image_path, original_size, original_md5)
+                except ValueError:
+                    os.remove(image_path)
+                    return row, None, image_url, image_type, 'invalid'
+            return row, image_path, image_url, image_type, 'downloaded'
+
+    if failed:
+        return row, None, *failed, 'failed'
+    return row, None, None, None, 'unavailable'
+
 
-from lib import logging, sql, make_image_name, is_url_available, rotate_bbox
-from settings import DATASET, IMAGES_DIR, DATASET_DB, LABELS_DIR, BBOX_COLORS, PREVIEWS_DIR
+class ImageTask:
+    def __init__(self, seq, row, labels):
+        self.seq = seq
+        self.row = row
+        self.image_id = row[0]
+        self.rotation = row[3]
+        self.labels = labels
+        self.status = None
+        self.image_path = None
+        self.image_type = None
+        self.img_bgr = None
+        self.label_names = [label[0] for label in labels]
+        self.boxes = None
+        self.content = None
+        self.size = None
+
+
+def fetch_stage(task, fetch, args, logger):
+    _, task.image_path, image_url, task.image_type, task.status = fetch(task.row)
+
+    metrics.inc(f'images_{task.status}')
+    if task.status == 'failed':
+        logger.warn(f'[{args.set}:{task.image_id}:{task.image_type}] {image_url} failed, retry with the next run')
+    elif task.status == 'unavailable':
+        logger.debug('[%s:%s] Image unavailable', args.set, task.image_id)
+    elif task.status == 'invalid':
+        logger.warn(f'[{args.set}:{task.image_id}:{task.image_type}] {image_url} does not match original_md5')
+    elif task.status == 'exists':
+        logger.debug('[%s:%s:%s] %s already exists', args.set, task.image_id, task.image_type, task.image_path)
+    elif task.status == 'cached':
+        logger.debug(
+            '[%s:%s:%s] Linked cached image -> %s', args.set, task.image_id, task.image_type, task.image_path
+        )
+    else:
+        logger.debug(
+            '[%s:%s:%s] Downloaded image %s -> %s',
+            args.set, task.image_id, task.image_type, image_url, task.image_path,
+        )
+    return task
+
+
+def decode_stage(task, args, logger):
+    if task.status in ('unavailable', 'invalid', 'failed'):
+        return task
+
+    # Labels only need a valid file and its size from the header, previews and resizing need the pixels
+    with metrics.timer('probe'):
+        width, height, error = probe_image(task.image_path)
+    # Images within max_side are kept as downloaded, unless they are letterboxed or re-encoded
+    resize = not error and task.status in ('downloaded', 'cached') and bool(
+        args.jpeg_quality or args.letterbox or (args.max_side and max(width, height) > args.max_side)
+    )
+    if not error and (resize or not args.without_preview):
+        # Resizing rewrites the image at full quality, a preview alone can be decoded at a reduced scale
+        with metrics.timer('decode'):
+            if resize:
+                task.img_bgr = cv2.imread(task.image_path)
+            else:
+                task.img_bgr = read_image(task.image_path, args.preview_max_side, (width, height))
+        if task.img_bgr is None:
+            error = 'Decode failed'
+
+    if error:
+        metrics.inc('images_invalid')
+        logger.warn(f'[{args.set}:{task.image_id}] Invalid image: {error}')
+        os.remove(task.image_path)
+        task.status = 'invalid'
+        return task
+    task.size = width, height
+
+    if resize:
+        img_height, img_width, _ = task.img_bgr.shape
+        with metrics.timer('resize'):
+            if args.max_side:
+                task.img_bgr, task.content = resize_image(task.img_bgr, args.max_side, letterbox=args.letterbox)
+            write_image(task.image_path, task.img_bgr, jpeg_quality=args.jpeg_quality)
+        task.size = task.img_bgr.shape[1], task.img_bgr.shape[0]
+        logger.debug(
+            '[%s:%s:%s] Resized %dx%d -> %dx%d',
+            args.set, task.image_id, task.image_type, img_width, img_height, *task.size,
+        )
+        if args.without_preview:
+            task.img_bgr = None
+        elif args.preview_max_side:
+            task.img_bgr = resize_image(task.img_bgr, args.preview_max_side)[0]
+    return task
+
+
+def label_stage(task, classes, labels_dir, shards, args, logger):
+    if task.status in ('unavailable', 'invalid', 'failed'):
+        return task
+
+    if task.content:
+        task.boxes = letterbox_boxes(task.boxes, task.content).tolist()
+    labels = ''.join(
+        f'{classes[class_name]} {x} {y} {width} {height}\n'
+        for class_name, (x, y, width, height) in zip(task.label_names, task.boxes)
+    )
+    labels_path = os.path.join(labels_dir, f'{task.image_id}.txt')
+    if shards is None and os.path.exists(labels_path) and not args.overwrite:
+        metrics.inc('labels_skipped')
+        logger.debug('[%s:%s:label] %s already exists', args.set, task.image_id, labels_path)
+    elif args.letterbox and not task.content:
+        # The padding of an image letterboxed by an earlier run is not known
+        metrics.inc('images_invalid')
+        logger.warn(f'[{args.set}:{task.image_id}:label] Letterbox unknown, rerun with --overwrite')
+        task.status = 'invalid'
+    elif shards is not None:
+        logger.debug('[%s:%s:label] Packing image and labels -> %s', args.set, task.image_id, shards.path)
+        with open(task.image_path, 'rb') as f:
+            image = f.read()
+        shards.write(task.image_id, {os.path.splitext(task.image_path)[1][1:]: image, 'txt': labels.encode()})
+        os.remove(task.image_path)
+        metrics.inc('images_packed')
+    else:
+        logger.debug('[%s:%s:label] Writing labels -> %s', args.set, task.image_id, labels_path)
+        with open(labels_path, 'w') as f:
+            f.write(labels)
+        metrics.inc('labels_written')
+    return task
+
+
+def preview_stage(task, classes, previews_dir, args, logger):
+    if task.status in ('unavailable', 'invalid', 'failed'):
+        return task
+
+    img_bgr, task.img_bgr = task.img_bgr, None
+    preview_path = os.path.join(previews_dir, os.path.basename(task.image_path))
+    if os.path.exists(preview_path) and not args.overwrite:
+        metrics.inc('previews_skipped')
+        logger.debug('[%s:%s:preview] %s already exists', args.set, task.image_id, preview_path)
+    else:
+        logger.debug('[%s:%s:preview] Drawing preview -> %s', args.set, task.image_id, preview_path)
+        img_height, img_width, _ = img_bgr.shape
+        logger.debug('[%s:%s:%s] %s %s', args.set, task.image_id, task.image_type, task.boxes, task.rotation)
+        draw_boxes(
+            img_bgr,
+            task.label_names,
+            to_pixels(task.boxes, img_width, img_height),
+            [classes[class_name] for class_name in task.label_names],
+            BBOX_COLORS,
+        )
+
+        with metrics.timer('preview_write'):
+            write_image(preview_path, img_bgr, jpeg_quality=args.preview_quality)
+        metrics.inc('previews_written')
+    return task
 
 
 def main(args):
@@ -25,107 +269,168 @@ def main(args):
     if not args.without_preview:
         os.makedirs(previews_dir, exist_ok=True)
 
-    with closing(sqlite3.connect(DATASET_DB)) as conn:
-        cur = conn.cursor()
+    # The query cursors are iterated by the pipeline feeder thread
+    with ExitStack() as stack:
+        conn = stack.enter_context(closing(sqlite3.connect(DATASET_DB, check_same_thread=False)))
+        url_cache = stack.enter_context(closing(AvailabilityCache(URL_CACHE_DB, args.url_cache_ttl)))
+        cache = image_cache.from_args(args, IMAGE_CACHE_DIR, IMAGE_CACHE_SIZE)
+        if cache is not None:
+            stack.callback(cache.close)
+        register_functions(conn)
+        schema = sql_schema(conn)
+
+        try:
+            classes = load_classes(conn, args.classes)
+        except ValueError as e:
+            logger.error(e)
+            return
+        class_filter = classes.class_names if args.classes else None
 
-        if args.classes:
-            classes = args.classes
+        # Existing labels keep their class ids, so a subset of their classes is labeled with the same ids. Even with
+        # --overwrite, as the labels of images outside the selection are not rewritten
+        names_path = os.path.join(labels_dir, 'classes.names')
+        with os.scandir(labels_dir) as entries:
+            labeled = any(entry.name.endswith('.txt') for entry in entries)
+        shards_dir = os.path.join(SHARDS_DIR, args.set)
+        labeled = labeled or (os.path.isdir(shards_dir) and bool(os.listdir(shards_dir)))
+        if os.path.exists(names_path) and labeled:
+            with open(names_path, 'r') as f:
+                names = f.read()
+            if names != classes.names():
+                if not set(classes.class_names).issubset(names.splitlines()):
+                    logger.error(f'{names_path} lacks some of the classes, clear {labels_dir} to relabel the images')
+                    return
+                try:
+                    classes = load_classes(conn, names.splitlines())
+                except ValueError as e:
+                    logger.error(f'{names_path}: {e}')
+                    return
+                logger.info(f'Labeling with the class ids of {names_path}')
         else:
-            cur.execute(sql.select_classes())
-            classes = [c[1] for c in cur.fetchall()]
-
-        query, params = sql.select_images(
-            bboxes_table=DATASET['bboxes'][args.set]['table'],
-            labels_table=DATASET['labels'][args.set]['table'],
-            images_table=DATASET['images'][args.set]['table'],
-            class_names=args.classes,
-            limit=args.limit,
-            offset=args.offset
+            classes.write_names(names_path)
+
+        annotations_table = ANNOTATIONS[args.set]['table']
+        if not table_exists(conn, annotations_table):
+            annotations_table = None
+
+        # Packed images are skipped, and new shards are numbered after the existing ones
+        shards = None
+        if args.pack:
+            packed = packed_keys(shards_dir) if os.path.isdir(shards_dir) else set()
+            shards = ShardWriter(shards_dir, args.set, args.pack_size * 1024 * 1024)
+
+        # E.g. the output of sample_images.py
+        image_ids = None
+        if args.ids_file:
+            with open(args.ids_file, 'r') as f:
+                image_ids = {line.strip() for line in f if line.strip()}
+
+        def iter_tasks():
+            query, params = schema.select_images(
+                bboxes_table=DATASET['bboxes'][args.set]['table'],
+                labels_table=DATASET['labels'][args.set]['table'],
+                images_table=DATASET['images'][args.set]['table'],
+                class_names=class_filter,
+                limit=args.limit,
+                offset=args.offset,
+                annotations_table=annotations_table,
+                after_image_id=args.after,
+                shard=args.shard,
+            )
+            labels_stream = None
+            rows = metrics.timed_iter('sql_images', conn.execute(query, params))
+            if shards is not None:
+                rows = (row for row in rows if row[0] not in packed)
+            if image_ids is not None:
+                rows = (row for row in rows if row[0] in image_ids)
+            for seq, row in enumerate(rows):
+                if labels_stream is None:
+                    _query, _params = schema.select_labels_by_image(
+                        bboxes_table=DATASET['bboxes'][args.set]['table'],
+                        labels_table=DATASET['labels'][args.set]['table'],
+                        class_names=class_filter,
+                        from_image_id=row[0],
+                        annotations_table=annotations_table,
+                    )
+                    labels_stream = LabelsStream(metrics.timed_iter('sql_labels', conn.execute(_query, _params)))
+                yield ImageTask(seq, row, labels_stream.get(row[0]))
+
+        def iter_labeled_tasks():
+            # Boxes are converted a chunk of images at a time on the feeder thread
+            for task, boxes in iter_yolo_boxes((task, task.labels, task.rotation) for task in iter_tasks()):
+                task.boxes = boxes
+                yield task
+
+        fetch = partial(
+            fetch_image,
+            session=make_session(pool_size=args.concurrency, timeout=HTTP_TIMEOUT),
+            host_limiter=HostLimiter(args.per_host),
+            url_cache=url_cache,
+            cache=cache,
+            images_dir=images_dir,
+            overwrite=args.overwrite,
+            skip_head=args.skip_head,
         )
-        for row in conn.execute(query, params):
-            image_id, org_url, thumb_url, rotation = row
-
-            if is_url_available(thumb_url):
-                image_path = os.path.join(images_dir, make_image_name(image_id, thumb_url))
-                image_url = thumb_url
-                image_type = 'thumb'
-            elif is_url_available(org_url):
-                image_path = os.path.join(images_dir, make_image_name(image_id, org_url))
-                image_url = org_url
-                image_type = 'org'
-            else:
-                logger.warn(f'[{args.set}:{image_id}] Image unavailable')
-                continue
+        stages = [
+            Stage('fetch', partial(fetch_stage, fetch=fetch, args=args, logger=logger), args.concurrency),
+            Stage('decode', partial(decode_stage, args=args, logger=logger), args.decode_workers),
+            Stage(
+                'label',
+                partial(label_stage, classes=classes, labels_dir=labels_dir, shards=shards, args=args, logger=logger),
+                args.label_workers,
+            ),
+        ]
+        if not args.without_preview:
+            stages.append(Stage(
+                'preview',
+                partial(preview_stage, classes=classes, previews_dir=previews_dir, args=args, logger=logger),
+                args.preview_workers,
+            ))
+        pipeline = Pipeline(stages, stats_interval=args.stats_interval, logger=logger)
 
-            if os.path.exists(image_path) and not args.overwrite:
-                logger.info(f'[{args.set}:{image_id}:{image_type}] {image_path} already exists')
-            else:
-                logger.info(
-                    f'[{args.set}:{image_id}:{image_type}] '
-                    f'Downloading image {image_url} -> {image_path}'
-                )
-                response = requests.get(image_url)
-                with open(image_path, 'wb') as f:
-                    f.write(response.content)
-
-            img_bgr = cv2.imread(image_path)
-            if img_bgr is None:
-                logger.warn(f'[{args.set}:{image_id}] Invalid image')
-                os.remove(image_path)
-                continue
-
-            labels = []
-            labels_path = os.path.join(labels_dir, f'{image_id}.txt')
-            if os.path.exists(labels_path) and not args.overwrite:
-                logger.info(f'[{args.set}:{image_id}:label] {labels_path} already exists')
-            else:
-                logger.info(f'[{args.set}:{image_id}:label] Writing labels -> {labels_path}')
-                _query, _params = sql.select_labels(
-                    bboxes_table=DATASET['bboxes'][args.set]['table'],
-                    labels_table=DATASET['labels'][args.set]['table'],
-                    image_id=image_id,
-                    class_names=args.classes,
-                )
-                cur.execute(_query, _params)
-                labels = cur.fetchall()
-
-                with open(labels_path, 'w') as f:
-                    for class_name, x, y, width, height in labels:
-                        x, y, width, height = rotate_bbox(x, y, width, height, rotation)
-                        f.write(f'{classes.index(class_name)} {x} {y} {width} {height}\n')
-
-            if not args.without_preview:
-                preview_path = os.path.join(previews_dir, os.path.basename(image_path))
-                if os.path.exists(preview_path) and not args.overwrite:
-                    logger.info(f'[{args.set}:{image_id}:preview] {preview_path} already exists')
-                else:
-                    logger.info(f'[{args.set}:{image_id}:preview] Drawing preview -> {preview_path}')
-                    img_height, img_width, _ = img_bgr.shape
-                    for class_name, x, y, width, height in labels:
-                        logger.debug(
-                            f'[{args.set}:{image_id}:{image_type}] '
-                            f'{x} {y} {width} {height} {rotation}'
-                        )
-                        x, y, width, height = rotate_bbox(x, y, width, height, rotation)
-
-                        left = int((x - width / 2) * img_width)
-                        right = int((x + width / 2) * img_width)
-                        top = int((y - height / 2) * img_height)
-                        bottom = int((y + height / 2) * img_height)
-                        color = BBOX_COLORS[classes.index(class_name) % len(BBOX_COLORS)]
-
-                        cv2.rectangle(img_bgr, (left, top), (right, bottom), color, 1)
-                        cv2.putText(
-                            img_bgr,
-                            class_name,
-                            (left, top + 12),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            .5,
-                            color,
-                            lineType=cv2.LINE_AA
-                        )
-
-                    cv2.imwrite(preview_path, img_bgr)
+        # Images finish out of order, so track the last image_id before which all images are done
+        done = {}
+        next_seq = 0
+        last_image_id = None
+        sizes = []
+        letterboxes = []
+        unpadded = []
+        try:
+            with metrics.reporter('download_images', args, logger):
+                for task in pipeline.run(iter_labeled_tasks()):
+                    # Like dropped items, failed fetches stay ahead of the --after image_id to be retried
+                    if task.status == 'failed':
+                        continue
+                    done[task.seq] = task.image_id
+                    while next_seq in done:
+                        last_image_id = done.pop(next_seq)
+                        next_seq += 1
+                    if args.store_sizes and task.size:
+                        sizes.append((task.image_id, task.image_type, *task.size))
+                    if shards is None and task.status in ('downloaded', 'cached'):
+                        if task.content:
+                            letterboxes.append((task.image_id, task.image_type, *task.content))
+                        else:
+                            unpadded.append((task.image_id,))
+
+            # Written after the pipeline, when the feeder's cursors on the connection are done
+            if sizes:
+                conn.executescript(schema.create_table_image_sizes())
+                conn.executemany(schema.replace_into_image_sizes(), map(schema.parse_image_sizes, sizes))
+                conn.commit()
+                logger.info(f'[{args.set}] Stored the size of {len(sizes)} images in image_sizes')
+        finally:
+            # Also written when interrupted, as preview_image.py and extract_classes_from_yolo_dataset.py --from-db
+            # map the boxes into the local images with them
+            if letterboxes or (unpadded and table_exists(conn, 'letterboxes')):
+                conn.executescript(schema.create_table_letterboxes())
+                conn.executemany(schema.replace_into_letterboxes(), map(schema.parse_letterboxes, letterboxes))
+                conn.executemany(schema.delete_from_letterboxes(), map(schema.parse_letterboxes, unpadded))
+                conn.commit()
+            if shards is not None:
+                shards.close()
+            if last_image_id is not None:
+                logger.info(f'[{args.set}] Last image_id {last_image_id} (continue with --after {last_image_id})')
 
 
 if __name__ == '__main__':
@@ -154,6 +459,47 @@ if __name__ == '__main__':
         action='store_true',
         help='Without bbox preview',
     )
+    parser.add_argument(
+        '--max-side',
+        type=int,
+        help='Shrink downloaded images so that their longer side is at most MAX_SIDE pixels',
+    )
+    parser.add_argument(
+        '--letterbox',
+        action='store_true',
+        help='Scale and pad downloaded images to MAX_SIDE x MAX_SIDE squares (labels are adjusted)',
+    )
+    parser.add_argument(
+        '--jpeg-quality',
+        type=int,
+        help='Re-encode downloaded JPEG images with this quality (0-100)',
+    )
+    parser.add_argument(
+        '--preview-max-side',
+        type=int,
+        help='Decode and draw previews shrunk so that their longer side is at most PREVIEW_MAX_SIDE pixels',
+    )
+    parser.add_argument(
+        '--preview-quality',
+        type=int,
+        help='JPEG quality of previews (0-100)',
+    )
+    parser.add_argument(
+        '--pack',
+        action='store_true',
+        help='Pack images and labels into tar shards in shards/<set> instead of one file per image',
+    )
+    parser.add_argument(
+        '--pack-size',
+        type=int,
+        default=1024,
+        help='Size in MiB at which a new shard is started',
+    )
+    parser.add_argument(
+        '--ids-file',
+        type=str,
+        help='Download only the images listed in this file, one image_id per line',
+    )
     parser.add_argument(
         '--limit',
         type=int,
@@ -165,6 +511,72 @@ if __name__ == '__main__':
         default=0,
         help='Offset of the download images num',
     )
+    parser.add_argument(
+        '--after',
+        type=str,
+        metavar='IMAGE_ID',
+        help='Download images with image_id greater than IMAGE_ID',
+    )
+    parser.add_argument(
+        '--shard',
+        type=parse_shard,
+        metavar='K/N',
+        help='Download only the K-th (0 <= K < N) of N disjoint image_id hash partitions',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=1,
+        help='Number of images downloaded concurrently',
+    )
+    parser.add_argument(
+        '--decode-workers',
+        type=int,
+        default=1,
+        help='Number of threads decoding (or, without preview, validating) images',
+    )
+    parser.add_argument(
+        '--label-workers',
+        type=int,
+        default=1,
+        help='Number of threads writing labels',
+    )
+    parser.add_argument(
+        '--preview-workers',
+        type=int,
+        default=1,
+        help='Number of threads drawing previews',
+    )
+    parser.add_argument(
+        '--store-sizes',
+        action='store_true',
+        help='Store the width and height of the local images in the image_sizes table',
+    )
+    parser.add_argument(
+        '--stats-interval',
+        type=float,
+        default=10,
+        help='Seconds between pipeline throughput and queue depth logs',
+    )
+    parser.add_argument(
+        '--per-host',
+        type=int,
+        default=8,
+        help='Max concurrent connections per host',
+    )
+    parser.add_argument(
+        '--skip-head',
+        action='store_true',
+        help='Decide image availability from the GET response instead of a HEAD request',
+    )
+    image_cache.add_arguments(parser)
+    parser.add_argument(
+        '--url-cache-ttl',
+        type=int,
+        default=URL_CACHE_TTL,
+        help='Seconds to trust cached URL availability',
+    )
+    metrics.add_arguments(parser)
     parser.add_argument(
         '-l', '--loglevel',
         type=str.upper,
@@ -172,4 +584,7 @@ if __name__ == '__main__':
         default='INFO',
     )
 
-    main(parser.parse_args())
+    args = parser.parse_args()
+    if args.letterbox and not args.max_side:
+        parser.error('--letterbox requires --max-side')
+    main(args)
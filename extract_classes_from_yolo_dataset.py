@@ -2,55 +2,205 @@
 
 import argparse
 import csv
+import io
 import os
-import shutil
+import sqlite3
+from contextlib import closing, ExitStack
+from functools import partial
 
-from lib import logging
+from lib import logging, metrics, sql_schema, make_image_name, table_exists, link_file, letterbox_finder
+from lib.bbox import letterbox_boxes
+from lib.classes import load_classes
+from lib.labels import LabelsStream, iter_yolo_boxes
+from lib.pipeline import Stage, Pipeline
+from lib.shards import ShardWriter, iter_samples
+from settings import DATASET, DATASET_DB, ANNOTATIONS
 
 
-def main(args):
-    logger = logging.getLogger(__name__)
-    logger.setLevel(args.loglevel)
+def extract_labels(lines, extract_class_nos):
+    labels = []
+    for row in csv.reader(lines, delimiter=' '):
+        if int(row[0]) in extract_class_nos:
+            labels.append([extract_class_nos.index(int(row[0])), *row[1:5]])
+    return labels
+
+
+def format_labels(labels):
+    f = io.StringIO()
+    writer = csv.writer(f, delimiter=' ')
+    writer.writerows(labels)
+    return f.getvalue()
+
+
+def write_sample(image_name, image_path, image, labels, output, logger):
+    logger.debug('Found labels on %s', image_name)
+    key, image_ext = os.path.splitext(image_name)
+
+    if output['shards'] is not None:
+        if image is None:
+            with open(image_path, 'rb') as f:
+                image = f.read()
+        logger.debug('Pack image and labels %s -> %s', image_name, output['shards'].path)
+        output['shards'].write(key, {image_ext[1:]: image, 'txt': format_labels(labels).encode()})
+        metrics.inc('images_packed')
+        return image_name
+
+    image_dst_path = os.path.join(output['images_dir'], image_name)
+    label_dst_path = os.path.join(output['labels_dir'], key + '.txt')
+
+    if image is None:
+        logger.debug('Copy image %s -> %s', image_path, image_dst_path)
+        link_file(image_path, image_dst_path, output['link_mode'])
+    else:
+        logger.debug('Write image -> %s', image_dst_path)
+        with open(image_dst_path, 'wb') as f:
+            f.write(image)
+
+    logger.debug('Write labels -> %s', label_dst_path)
+    with open(label_dst_path, 'w') as f:
+        f.write(format_labels(labels))
+    metrics.inc('images_written')
+    metrics.inc('labels_written')
+    return image_name
+
+
+def extract_file(image_path, extract_class_nos, output, logger):
+    label_path = os.path.join(
+        os.path.dirname(image_path.replace('/images/', '/labels/')),
+        os.path.splitext(os.path.basename(image_path))[0] + '.txt'
+    )
 
-    images_dir = os.path.join(args.output_dir, 'images')
-    os.makedirs(images_dir, exist_ok=True)
+    try:
+        with open(label_path, 'r') as f:
+            labels = extract_labels(f, extract_class_nos)
+    except FileNotFoundError:
+        metrics.inc('labels_missing')
+        logger.warn('Label file {} not found'.format(label_path))
+        return None
 
-    labels_dir = os.path.join(args.output_dir, 'labels')
-    os.makedirs(labels_dir, exist_ok=True)
+    if not labels:
+        metrics.inc('images_skipped')
+        return None
+    return write_sample(os.path.basename(image_path), image_path, None, labels, output, logger)
 
-    logger.info('Extract classes {} from {}'.format(args.extract_class_nos, args.images_list))
-    with open(args.images_list, 'r') as f:
-        for image_path in f.readlines():
-            image_path = image_path.rstrip('\n')
-            label_path = os.path.join(
-                os.path.dirname(image_path.replace('/images/', '/labels/')),
-                os.path.splitext(os.path.basename(image_path))[0] + '.txt'
-            )
 
-            if not os.path.exists(label_path):
-                logger.warn('Label file {} not found'.format(label_path))
-                continue
+def extract_shard_sample(sample, extract_class_nos, output, logger):
+    key, files = sample
+    if 'txt' not in files:
+        metrics.inc('labels_missing')
+        logger.warn('Labels of {} not found'.format(key))
+        return None
 
-            labels = []
-            with open(label_path, 'r') as _f:
-                reader = csv.reader(_f, delimiter=" ")
-                for row in reader:
-                    if int(row[0]) in args.extract_class_nos:
-                        labels.append([args.extract_class_nos.index(int(row[0])), *row[1:5]])
+    labels = extract_labels(files['txt'].decode().splitlines(), extract_class_nos)
+    if not labels:
+        metrics.inc('images_skipped')
+        return None
+    image_ext = next(ext for ext in files if ext != 'txt')
+    return write_sample(f'{key}.{image_ext}', None, files[image_ext], labels, output, logger)
 
-            if labels:
-                logger.info('Found labels on {}'.format(os.path.basename(image_path)))
 
-                image_dst_path = os.path.join(images_dir, os.path.basename(image_path))
-                label_dst_path = os.path.join(labels_dir, os.path.basename(label_path))
+def extract_db_image(task, images_dir, output, logger):
+    (image_id, org_url, thumb_url, rotation, _, _), labels = task
 
-                logger.info('Copy image {} -> {}'.format(image_path, image_dst_path))
-                shutil.copyfile(image_path, image_dst_path)
+    for image_url in (thumb_url, org_url):
+        if image_url:
+            image_path = os.path.join(images_dir, make_image_name(image_id, image_url))
+            if os.path.exists(image_path):
+                break
+    else:
+        metrics.inc('images_missing')
+        logger.warn('Image {} not found in {}'.format(image_id, images_dir))
+        return None
+
+    return write_sample(os.path.basename(image_path), image_path, None, labels, output, logger)
+
+
+def iter_list(images_list):
+    with open(images_list, 'r') as f:
+        for image_path in f:
+            yield image_path.rstrip('\n')
+
+
+def iter_db_images(conn, args, classes):
+    # Labels are built from the DB instead of the label files of the images
+    schema = sql_schema(conn)
+    annotations_table = ANNOTATIONS[args.set]['table']
+    if not table_exists(conn, annotations_table):
+        annotations_table = None
+
+    query, params = schema.select_images(
+        bboxes_table=DATASET['bboxes'][args.set]['table'],
+        labels_table=DATASET['labels'][args.set]['table'],
+        images_table=DATASET['images'][args.set]['table'],
+        class_names=classes.class_names,
+        annotations_table=annotations_table,
+    )
+    _query, _params = schema.select_labels_by_image(
+        bboxes_table=DATASET['bboxes'][args.set]['table'],
+        labels_table=DATASET['labels'][args.set]['table'],
+        class_names=classes.class_names,
+        annotations_table=annotations_table,
+    )
+    labels_stream = LabelsStream(metrics.timed_iter('sql_labels', conn.execute(_query, _params)))
+    rows = metrics.timed_iter('sql_images', conn.execute(query, params))
+    labeled = ((row, labels_stream.get(row[0])) for row in rows)
+    # Images letterboxed by download_images.py are padded, so their boxes are mapped into the recorded content
+    find_letterbox = letterbox_finder(conn)
+    # Boxes are converted a chunk of images at a time
+    for (row, labels), boxes in iter_yolo_boxes(((row, labels), labels, row[3]) for row, labels in labeled):
+        content = find_letterbox(row[0])
+        if content and boxes:
+            boxes = letterbox_boxes(boxes, content).tolist()
+        yield row, [[classes[label[0]], *box] for label, box in zip(labels, boxes)]
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
 
-                logger.info('Write labels -> {}'.format(label_path))
-                with open(label_dst_path, 'w') as _f:
-                    writer = csv.writer(_f, delimiter=" ")
-                    writer.writerows(labels)
+    output = {'shards': None, 'link_mode': args.link_mode}
+    if args.pack:
+        output['shards'] = ShardWriter(
+            args.output_dir,
+            os.path.basename(os.path.normpath(args.output_dir)),
+            args.pack_size * 1024 * 1024,
+        )
+    else:
+        output['images_dir'] = os.path.join(args.output_dir, 'images')
+        os.makedirs(output['images_dir'], exist_ok=True)
+
+        output['labels_dir'] = os.path.join(args.output_dir, 'labels')
+        os.makedirs(output['labels_dir'], exist_ok=True)
+
+    with ExitStack() as stack:
+        if args.from_db:
+            # The DB cursors are iterated by the pipeline feeder thread
+            conn = stack.enter_context(closing(sqlite3.connect(DATASET_DB, check_same_thread=False)))
+            try:
+                classes = load_classes(conn, args.classes)
+            except ValueError as e:
+                logger.error(e)
+                return
+            logger.info('Extract classes {} of {} from {}'.format(args.classes, args.set, args.images_list))
+            items = iter_db_images(conn, args, classes)
+            extract = partial(extract_db_image, images_dir=args.images_list, output=output, logger=logger)
+        else:
+            logger.info('Extract classes {} from {}'.format(args.extract_class_nos, args.images_list))
+            if args.from_shards:
+                items = iter_samples(args.images_list)
+                extract = extract_shard_sample
+            else:
+                items = iter_list(args.images_list)
+                extract = extract_file
+            extract = partial(extract, extract_class_nos=args.extract_class_nos, output=output, logger=logger)
+
+        if output['shards'] is not None:
+            stack.callback(output['shards'].close)
+        stack.enter_context(metrics.reporter('extract_classes', args, logger))
+        pipeline = Pipeline([Stage('extract', extract, args.workers)], logger=logger)
+        count = sum(1 for _ in pipeline.run(items))
+
+    logger.info('Extracted {} images to {}'.format(count, args.output_dir))
 
 
 if __name__ == '__main__':
@@ -59,6 +209,8 @@ if __name__ == '__main__':
     parser.add_argument(
         'images_list',
         type=str,
+        help='File listing image paths, a directory of tar shards with --from-shards, '
+             'or the images directory of --set with --from-db',
     )
     parser.add_argument(
         'output_dir',
@@ -68,8 +220,55 @@ if __name__ == '__main__':
         '--extract_class_nos',
         type=int,
         nargs='+',
-        required=True,
     )
+    parser.add_argument(
+        '--from-shards',
+        action='store_true',
+        help='Read images and labels from the tar shards in images_list',
+    )
+    parser.add_argument(
+        '--from-db',
+        action='store_true',
+        help='Select the images of --classes from the DB instead of scanning label files',
+    )
+    parser.add_argument(
+        '--set',
+        type=str,
+        default='train',
+        choices=['train', 'validation', 'test'],
+        help='Set of data (train, validation or test) with --from-db',
+    )
+    parser.add_argument(
+        '--classes',
+        type=str,
+        nargs='+',
+        help='List of classes to extract with --from-db (e.g. Person "Human eye")',
+    )
+    parser.add_argument(
+        '--pack',
+        action='store_true',
+        help='Pack extracted images and labels into tar shards in output_dir',
+    )
+    parser.add_argument(
+        '--pack-size',
+        type=int,
+        default=1024,
+        help='Size in MiB at which a new shard is started',
+    )
+    parser.add_argument(
+        '--link-mode',
+        type=str,
+        choices=['copy', 'hardlink', 'reflink'],
+        default='copy',
+        help='How images are placed in output_dir (reflink copies in the kernel with copy_file_range)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=8,
+        help='Number of threads extracting images',
+    )
+    metrics.add_arguments(parser)
     parser.add_argument(
         '-l', '--loglevel',
         type=str.upper,
@@ -77,4 +276,9 @@ if __name__ == '__main__':
         default='INFO',
     )
 
-    main(parser.parse_args())
+    args = parser.parse_args()
+    if args.from_db and not args.classes:
+        parser.error('--from-db requires --classes')
+    if not args.from_db and not args.extract_class_nos:
+        parser.error('--extract_class_nos is required')
+    main(args)
@@ -1,80 +1,247 @@
 #!/usr/bin/env python
 import argparse
-import csv
+import multiprocessing
 import os
+import shutil
 import sqlite3
+import time
 from contextlib import closing
 
-from lib import sql
-from lib import logging
-from settings import DATASET, DATASET_DB
+from lib import logging, metrics, table_exists, sql_schema, schema_name, SCHEMAS
+from lib.columnar import build_columnar
+from lib.importer import (
+    JOURNAL_MODES,
+    table_kind,
+    set_import_pragmas,
+    find_checkpoint,
+    import_table,
+    create_indexes,
+    import_shard,
+    merge_shard,
+    materialize_annotations,
+    build_class_stats,
+)
+from settings import DATASET, DATASET_DB, ANNOTATIONS, COLUMNAR_DIR, CLASS_STATS
+
+
+def import_parallel(conn, args, logger):
+    shards_dir = f'{DATASET_DB}.shards'
+    os.makedirs(shards_dir, exist_ok=True)
+
+    tasks = []
+    for group, dataset in DATASET.items():
+        for subgroup, ref in dataset.items():
+            checkpoint = find_checkpoint(conn, ref['table'], ref['local_path'])
+            if checkpoint and checkpoint[1]:
+                logger.info(f'{ref["table"]} is up to date with {ref["local_path"]}')
+                continue
+            tasks.append((
+                table_kind(group, subgroup),
+                ref['table'],
+                ref['local_path'],
+                os.path.join(shards_dir, f'{ref["table"]}.sqlite'),
+                args.batch_size,
+                args.journal_mode,
+                args.cache_size,
+                args.schema,
+                args.loglevel,
+            ))
+
+    # Largest files first so the long train CSVs do not start last
+    tasks.sort(key=lambda task: os.path.getsize(task[2]), reverse=True)
+
+    logger.info(f'Importing {len(tasks)} CSV files with {args.workers} workers')
+    rebuilt = set()
+    with multiprocessing.Pool(args.workers) as pool:
+        for kind, table, shard_path in pool.imap_unordered(import_shard, tasks):
+            merge_shard(conn, kind, table, shard_path, logger=logger, schema=SCHEMAS[args.schema])
+            rebuilt.add(table)
+
+    os.rmdir(shards_dir)
+    return rebuilt
+
+
+def import_serial(conn, args, logger):
+    rebuilt = set()
+    for group, dataset in DATASET.items():
+        for subgroup, ref in dataset.items():
+            imported = import_table(
+                conn,
+                table_kind(group, subgroup),
+                ref['table'],
+                ref['local_path'],
+                batch_size=args.batch_size,
+                logger=logger,
+                schema=SCHEMAS[args.schema],
+            )
+            if imported:
+                rebuilt.add(ref['table'])
+    return rebuilt
+
+
+def materialize(conn, args, rebuilt, logger):
+    for split, ref in ANNOTATIONS.items():
+        sources = [
+            DATASET['metadata']['classes']['table'],
+            DATASET['bboxes'][split]['table'],
+            DATASET['labels'][split]['table'],
+            DATASET['images'][split]['table'],
+        ]
+        stale = bool(rebuilt.intersection(sources))
+        if table_exists(conn, ref['table']):
+            # Tables materialized before they held the original size and MD5 of the images
+            columns = {row[0] for row in conn.execute(*sql_schema(conn).select_table_columns(ref['table']))}
+            stale = stale or 'original_md5' not in columns
+
+        if args.materialize and (stale or not table_exists(conn, ref['table'])):
+            logger.info(f'Materializing {ref["table"]}')
+            materialize_annotations(conn, ref['table'], *sources[1:], logger=logger)
+        elif stale and table_exists(conn, ref['table']):
+            logger.info(f'Dropping stale {ref["table"]}')
+            conn.execute(f'drop table {ref["table"]}')
+            conn.commit()
+
+
+def build_stats(conn, args, rebuilt, logger):
+    for split, tables in CLASS_STATS.items():
+        sources = [
+            DATASET['metadata']['classes']['table'],
+            DATASET['bboxes'][split]['table'],
+            DATASET['labels'][split]['table'],
+        ]
+        stale = bool(rebuilt.intersection(sources))
+        exists = all(table_exists(conn, table) for table in tables.values())
+
+        if not args.without_stats and (stale or not exists):
+            logger.info(f'Building class statistics of {split}')
+            build_class_stats(conn, tables, *sources[1:], logger=logger)
+        elif stale:
+            for table in tables.values():
+                if table_exists(conn, table):
+                    logger.info(f'Dropping stale {table}')
+                    conn.execute(f'drop table {table}')
+            conn.commit()
+
+
+def build_columnar_stores(conn, args, rebuilt, logger):
+    for split in ANNOTATIONS.keys():
+        sources = [
+            DATASET['metadata']['classes']['table'],
+            DATASET['bboxes'][split]['table'],
+            DATASET['labels'][split]['table'],
+        ]
+        stale = bool(rebuilt.intersection(sources))
+        path = os.path.join(COLUMNAR_DIR, split)
+
+        if args.columnar and (stale or not os.path.exists(path)):
+            logger.info(f'Building columnar store {path}')
+            started_at = time.monotonic()
+            count = build_columnar(conn, path, *sources[1:])
+            logger.info(f'Built columnar store {path} with {count} boxes in {time.monotonic() - started_at:.1f}s')
+        elif stale and os.path.exists(path):
+            logger.info(f'Removing stale columnar store {path}')
+            shutil.rmtree(path)
 
 
 def main(args):
     logger = logging.getLogger(__name__)
     logger.setLevel(args.loglevel)
 
-    try:
-        os.remove(DATASET_DB)
-    except OSError:
-        pass
+    if args.force:
+        try:
+            os.remove(DATASET_DB)
+        except OSError:
+            pass
 
     with closing(sqlite3.connect(DATASET_DB)) as conn:
-        c = conn.cursor()
-
-        # Import metadata:classes
-        ref = DATASET['metadata']['classes']
-        logger.info(f'Creating table {ref["table"]}')
-        c.executescript(sql.create_table_classes(ref["table"]))
-
-        logger.info(f'Importing classes from {ref["local_path"]} to {ref["table"]}')
-        with open(ref["local_path"], 'r') as f:
-            reader = csv.reader(f)
-            for row in reader:
-                c.execute(*sql.insert_into_classes(ref["table"], row))
-
-        # Import bboxes
-        for ref in DATASET['bboxes'].values():
-            logger.info(f'Creating table {ref["table"]}')
-            c.executescript(sql.create_table_bboxes(ref["table"]))
-
-            logger.info(f'Importing from {ref["local_path"]} to {ref["table"]}')
-            with open(ref["local_path"], 'r') as f:
-                reader = csv.reader(f)
-                next(reader)
-                for row in reader:
-                    c.execute(*sql.insert_into_bboxes(ref["table"], row))
-
-        # Import labels
-        for ref in DATASET['labels'].values():
-            logger.info(f'Creating table {ref["table"]}')
-            c.executescript(sql.create_table_labels(ref["table"]))
-
-            logger.info(f'Importing from {ref["local_path"]} to {ref["table"]}')
-            with open(ref["local_path"], 'r') as f:
-                reader = csv.reader(f)
-                next(reader)
-                for row in reader:
-                    c.execute(*sql.insert_into_labels(ref["table"], row))
-
-        # Import images
-        for ref in DATASET['images'].values():
-            logger.info(f'Creating table {ref["table"]}')
-            c.executescript(sql.create_table_images(ref["table"]))
-
-            logger.info(f'Importing from {ref["local_path"]} to {ref["table"]}')
-            with open(ref["local_path"], 'r') as f:
-                reader = csv.reader(f)
-                next(reader)
-                for row in reader:
-                    c.execute(*sql.insert_into_images(ref["table"], row))
-
-        conn.commit()
+        set_import_pragmas(conn, journal_mode=args.journal_mode, cache_size=args.cache_size)
+
+        # An existing DB keeps its schema until it is rebuilt with --force
+        if table_exists(conn, 'import_manifest') and schema_name(sql_schema(conn)) != args.schema:
+            logger.error(f'{DATASET_DB} uses the {schema_name(sql_schema(conn))} schema, use --force to rebuild it')
+            return
+        conn.executescript(SCHEMAS[args.schema].create_table_lookups())
+
+        with metrics.reporter('import_dataset', args, logger):
+            # Import metadata:classes, bboxes, labels and images
+            if args.workers > 1:
+                rebuilt = import_parallel(conn, args, logger)
+            else:
+                rebuilt = import_serial(conn, args, logger)
+
+            # Create indexes after all rows are loaded (no-op for tables that were not rebuilt)
+            for group, dataset in DATASET.items():
+                for subgroup, ref in dataset.items():
+                    create_indexes(
+                        conn,
+                        table_kind(group, subgroup),
+                        ref['table'],
+                        logger=logger,
+                        schema=SCHEMAS[args.schema],
+                    )
+
+            # Materialize filtered annotations per split, or drop them when their sources changed
+            materialize(conn, args, rebuilt, logger)
+            build_stats(conn, args, rebuilt, logger)
+            build_columnar_stores(conn, args, rebuilt, logger)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
+    parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Remove the existing DB and import all CSV files from scratch',
+    )
+    parser.add_argument(
+        '--materialize',
+        action='store_true',
+        help='Build per-split annotations tables of filtered boxes joined with classes and images',
+    )
+    parser.add_argument(
+        '--columnar',
+        action='store_true',
+        help='Build per-split memory-mapped NumPy column stores of the bboxes, read by sample_images.py --columnar',
+    )
+    parser.add_argument(
+        '--without-stats',
+        action='store_true',
+        help='Without the per-split class statistics tables used by sample_images.py',
+    )
+    parser.add_argument(
+        '--schema',
+        type=str,
+        choices=list(SCHEMAS),
+        default='text',
+        help='Table layout (compact stores image ids, label names and sources as integer keys)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='Number of processes importing CSV files in parallel',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=50000,
+        help='Number of rows inserted per executemany batch',
+    )
+    parser.add_argument(
+        '--journal-mode',
+        type=str.upper,
+        choices=JOURNAL_MODES,
+        default='WAL',
+        help='SQLite journal mode used while importing (OFF is faster but not resumable)',
+    )
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=512,
+        help='SQLite page cache size in MiB used while importing',
+    )
+    metrics.add_arguments(parser)
     parser.add_argument(
         '-l', '--loglevel',
         type=str.upper,
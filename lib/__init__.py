@@ -1,23 +1,129 @@
+import errno
+import hashlib
 import os
+import shutil
 import urllib.parse
+import zlib
 
 import requests
 
+from lib import metrics, sql, sql_compact
+
+SCHEMAS = {'text': sql, 'compact': sql_compact}
+
 
 def make_image_name(image_id, url):
     return '{}{}'.format(image_id, os.path.splitext(urllib.parse.urlparse(url).path)[1])
 
 
-def is_url_available(url):
-    return url and requests.head(url).status_code != 302
+def md5sum(path, chunk_size=8 * 1024 * 1024):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def copy_file_range(src, dst):
+    # Copies in the kernel, which shares the extents on filesystems with reflinks
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if copied == 0:
+                break
+            remaining -= copied
+
+
+def link_file(src, dst, mode='copy'):
+    """Places src at dst as a hardlink, an in-kernel copy (reflink) or a plain copy, falling back to a plain copy."""
+    if os.path.lexists(dst):
+        if os.path.abspath(src) == os.path.abspath(dst):
+            raise shutil.SameFileError(f'{src!r} and {dst!r} are the same file')
+        # dst may be a hardlink of src from an earlier run, writing through it would truncate src
+        os.remove(dst)
+
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+            return
+        if mode == 'reflink':
+            copy_file_range(src, dst)
+            return
+    except AttributeError:
+        pass
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EPERM, errno.EINVAL):
+            raise
+    shutil.copyfile(src, dst)
+
+
+def is_url_available(url, session=requests, cache=None):
+    if not url:
+        return False
+
+    if cache is not None:
+        available = cache.get(url)
+        if available is not None:
+            metrics.inc('url_cache_hits')
+            return available
+
+    with metrics.timer('http_head'):
+        response = session.head(url)
+    available = url_availability(response)
+    if cache is not None and available is not None:
+        cache.set(url, response, available)
+    # Transient answers (429, 5xx) are left to the GET
+    return available is not False
+
+
+def url_availability(response):
+    """Returns True for an image, False for a removed one and None for answers that may change on a retry.
+
+    Flickr redirects removed images with a 302 to a placeholder, other hosts answer 404 or 410.
+    """
+    if response.status_code == 200:
+        return True
+    if response.status_code in (302, 404, 410):
+        return False
+    return None
+
+
+def table_exists(conn, table):
+    return conn.execute(*sql.select_table_exists(table)).fetchone() is not None
+
+
+def sql_schema(conn):
+    # Compact DBs are recognized by their label name lookup table
+    return sql_compact if table_exists(conn, 'label_names') else sql
+
+
+def letterbox_finder(conn):
+    """Returns a function of an image_id to the content (x, y, width, height) of its letterboxed local image, or None.
+
+    Letterboxes are recorded by download_images.py --letterbox.
+    """
+    if not table_exists(conn, 'letterboxes'):
+        return lambda image_id: None
+    schema = sql_schema(conn)
+    return lambda image_id: conn.execute(*schema.select_letterbox(image_id)).fetchone()
+
+
+def schema_name(schema):
+    return next(name for name, module in SCHEMAS.items() if module is schema)
+
+
+def image_shard(image_id, shards):
+    return zlib.crc32(image_id.encode()) % shards
+
+
+def parse_shard(value):
+    shard, _, shards = value.partition('/')
+    shard, shards = int(shard), int(shards)
+    if not 0 <= shard < shards:
+        raise ValueError(f'Shard {value} must be k/N with 0 <= k < N')
+    return shard, shards
 
 
-def rotate_bbox(x, y, width, height, rotation):
-    if rotation == 90:
-        return y, 1 - x, height, width
-    elif rotation == 180:
-        return 1 - x, 1 - y, width, height
-    elif rotation == 270:
-        return 1 - y, x, height, width
-    else:
-        return x, y, width, height
+def register_functions(conn):
+    conn.create_function('image_shard', 2, image_shard)
@@ -0,0 +1,68 @@
+import numpy as np
+
+
+def as_boxes(boxes):
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+
+def xyxy_to_cxcywh(boxes):
+    boxes = as_boxes(boxes)
+    x_min, y_min, x_max, y_max = boxes.T
+    return np.stack([
+        x_min + (x_max - x_min) / 2,
+        y_min + (y_max - y_min) / 2,
+        x_max - x_min,
+        y_max - y_min,
+    ], axis=1)
+
+
+def cxcywh_to_xyxy(boxes):
+    boxes = as_boxes(boxes)
+    x, y, width, height = boxes.T
+    return np.stack([
+        x - width / 2,
+        y - height / 2,
+        x + width / 2,
+        y + height / 2,
+    ], axis=1)
+
+
+def clip_boxes(boxes, low=0., high=1.):
+    return np.clip(as_boxes(boxes), low, high)
+
+
+def rotate_boxes(boxes, rotation):
+    # rotation is a scalar for one image or an array with one value per box for a chunk of images
+    boxes = as_boxes(boxes)
+    rotation = np.broadcast_to(
+        np.asarray(rotation if rotation is not None else 0, dtype=np.float64),
+        boxes.shape[:1]
+    )
+    x, y, width, height = boxes.T
+
+    rotated = boxes.copy()
+    for angle, columns in (
+        (90, (y, 1 - x, height, width)),
+        (180, (1 - x, 1 - y, width, height)),
+        (270, (1 - y, x, height, width)),
+    ):
+        mask = rotation == angle
+        if mask.any():
+            rotated[mask] = np.stack(columns, axis=1)[mask]
+    return rotated
+
+
+def to_pixels(boxes, img_width, img_height):
+    # Normalized cxcywh to integer pixel (left, top, right, bottom)
+    return (cxcywh_to_xyxy(boxes) * [img_width, img_height, img_width, img_height]).astype(int)
+
+
+def yolo_boxes(xyxy, rotation):
+    return rotate_boxes(xyxy_to_cxcywh(clip_boxes(xyxy)), rotation)
+
+
+def letterbox_boxes(boxes, content):
+    # Normalized cxcywh in the original image to the letterboxed image whose content is at (x, y, width, height)
+    boxes = as_boxes(boxes)
+    x, y, width, height = content
+    return boxes * [width, height, width, height] + [x, y, 0, 0]
@@ -0,0 +1,40 @@
+from lib import sql
+
+
+class ClassRegistry:
+    def __init__(self, classes):
+        self.label_names = [label_name for label_name, _ in classes]
+        self.class_names = [class_name for _, class_name in classes]
+        self.ids = {}
+        for class_id, (label_name, class_name) in enumerate(classes):
+            self.ids[label_name] = class_id
+            self.ids.setdefault(class_name, class_id)
+
+    def __len__(self):
+        return len(self.class_names)
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __getitem__(self, name):
+        return self.ids[name]
+
+    def subset(self, names):
+        missing = [name for name in names if name not in self.ids]
+        if missing:
+            raise ValueError(f'Unknown classes: {", ".join(missing)}')
+        return ClassRegistry([
+            (self.label_names[self.ids[name]], self.class_names[self.ids[name]]) for name in names
+        ])
+
+    def names(self):
+        return ''.join(f'{class_name}\n' for class_name in self.class_names)
+
+    def write_names(self, path):
+        with open(path, 'w') as f:
+            f.write(self.names())
+
+
+def load_classes(conn, names=None):
+    registry = ClassRegistry(conn.execute(sql.select_classes()).fetchall())
+    return registry.subset(names) if names else registry
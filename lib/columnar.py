@@ -0,0 +1,190 @@
+import os
+import shutil
+import struct
+from contextlib import ExitStack
+
+import numpy as np
+
+from lib import sql, sql_schema
+
+FLAGS = ['is_occluded', 'is_truncated', 'is_group_of', 'is_depiction', 'is_inside']
+IMAGE_ID_SIZE = 16
+NPY_HEADER_SIZE = 128
+
+
+def build_columnar(conn, path, bboxes_table, labels_table, chunk_size=1000000):
+    label_names = [label_name for label_name, _ in conn.execute(sql.select_classes())]
+    label_ids = {label_name: i for i, label_name in enumerate(label_names)}
+
+    # Write to a temporary directory and swap it in so readers never see a partial store
+    tmp_path = f'{path}.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    with ExitStack() as stack:
+        def writer(name, dtype, shape=()):
+            return stack.enter_context(ArrayWriter(os.path.join(tmp_path, f'{name}.npy'), dtype, shape))
+
+        image_ids_file = writer('image_ids', f'S{IMAGE_ID_SIZE}')
+        offsets_file = writer('offsets', np.int64)
+        files = {
+            'image_index': writer('image_index', np.int32),
+            'label_index': writer('label_index', np.int32),
+            'confidence': writer('confidence', np.float32),
+            'boxes': writer('boxes', np.float32, (4,)),
+            'flags': writer('flags', np.int8, (len(FLAGS),)),
+            'verified': writer('verified', np.int8),
+        }
+
+        count = 0
+        images = 0
+        last_image_id = None
+        cur = conn.execute(sql_schema(conn).select_columnar_bboxes(bboxes_table, labels_table))
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            image_ids = []
+            starts = []
+            image_index = np.empty(len(rows), dtype=np.int32)
+            label_index = np.empty(len(rows), dtype=np.int32)
+            for i, row in enumerate(rows):
+                image_id, label_name = row[0], row[1]
+                if image_id != last_image_id:
+                    if len(image_id) != IMAGE_ID_SIZE:
+                        raise ValueError(f'Image id {image_id!r} is not {IMAGE_ID_SIZE} characters long')
+                    image_ids.append(image_id)
+                    starts.append(count + i)
+                    last_image_id = image_id
+                if label_name not in label_ids:
+                    label_ids[label_name] = len(label_names)
+                    label_names.append(label_name)
+                image_index[i] = images + len(image_ids) - 1
+                label_index[i] = label_ids[label_name]
+
+            values = np.array([row[2:] for row in rows], dtype=np.float64)
+            values[np.isnan(values)] = -1
+            image_ids_file.write(np.array(image_ids, dtype=f'S{IMAGE_ID_SIZE}'))
+            offsets_file.write(np.array(starts, dtype=np.int64))
+            files['image_index'].write(image_index)
+            files['label_index'].write(label_index)
+            files['confidence'].write(values[:, 0])
+            files['boxes'].write(values[:, 1:5])
+            files['flags'].write(values[:, 5:10])
+            files['verified'].write(values[:, 10])
+            count += len(rows)
+            images += len(image_ids)
+        offsets_file.write(np.array([count], dtype=np.int64))
+
+    np.save(os.path.join(tmp_path, 'label_names.npy'), np.array(label_names, dtype='S'))
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+    return count
+
+
+class ArrayWriter:
+    """Appends chunks to a .npy file, whose header is written on close once the length is known."""
+
+    def __init__(self, path, dtype, shape=()):
+        self.dtype = np.dtype(dtype)
+        self.shape = shape
+        self.length = 0
+        self.f = open(path, 'wb')
+        self.f.write(b'\0' * NPY_HEADER_SIZE)
+
+    def write(self, array):
+        array = np.ascontiguousarray(array, dtype=self.dtype)
+        if array.shape[1:] != self.shape:
+            raise ValueError(f'Expected rows of shape {self.shape}, got {array.shape[1:]}')
+        self.f.write(array.tobytes())
+        self.length += len(array)
+
+    def close(self):
+        # Format version 1.0: magic, header length and a dict literal padded with spaces and ending in a newline
+        header = repr({
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (self.length, *self.shape),
+        }).encode('latin1')
+        prefix = np.lib.format.MAGIC_PREFIX + bytes([1, 0])
+        size = NPY_HEADER_SIZE - len(prefix) - 2
+        if len(header) >= size:
+            raise ValueError(f'.npy header of {len(header)} bytes does not fit')
+        self.f.seek(0)
+        self.f.write(prefix + struct.pack('<H', size) + header.ljust(size - 1) + b'\n')
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ColumnarStore:
+    def __init__(self, path):
+        def load(name):
+            return np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+
+        self.image_ids = load('image_ids')
+        self.label_names = load('label_names')
+        self.offsets = load('offsets')
+        self.image_index = load('image_index')
+        self.label_index = load('label_index')
+        self.confidence = load('confidence')
+        self.boxes = load('boxes')
+        self.flags = load('flags')
+        self.verified = load('verified')
+
+    def __len__(self):
+        return len(self.label_index)
+
+    def find_image(self, image_id):
+        image_id = image_id.encode()
+        i = np.searchsorted(self.image_ids, image_id)
+        if i < len(self.image_ids) and self.image_ids[i] == image_id:
+            return i
+        return None
+
+    def image_rows(self, image_id):
+        i = self.find_image(image_id)
+        if i is None:
+            return slice(0, 0)
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def label_id(self, label_name):
+        matches = np.flatnonzero(self.label_names == label_name.encode())
+        return int(matches[0]) if len(matches) else None
+
+    def positive_mask(self):
+        # Same filter as select_images: verified labels and no group boxes
+        return (self.verified == 1) & (self.flags[:, FLAGS.index('is_group_of')] == 0)
+
+    def class_counts(self, mask=None):
+        label_index = self.label_index if mask is None else self.label_index[mask]
+        return np.bincount(label_index, minlength=len(self.label_names))
+
+    def class_image_counts(self, mask=None):
+        pairs = self.image_index.astype(np.int64) * len(self.label_names) + self.label_index
+        if mask is not None:
+            pairs = pairs[mask]
+        return np.bincount(np.unique(pairs) % len(self.label_names), minlength=len(self.label_names))
+
+    def box_areas(self):
+        boxes = self.boxes.astype(np.float64)
+        return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    def label_images(self, mask=None):
+        """Returns the image indices of the boxes of each label id under mask, sorted and without duplicates."""
+        rows = np.arange(len(self)) if mask is None else np.flatnonzero(mask)
+        label_index = self.label_index[rows]
+        order = np.argsort(label_index, kind='stable')
+        rows = rows[order]
+        bounds = np.searchsorted(label_index[order], np.arange(len(self.label_names) + 1))
+        return [np.unique(self.image_index[rows[start:end]]) for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def image_labels(self, i, mask=None):
+        rows = slice(self.offsets[i], self.offsets[i + 1])
+        return self.label_index[rows] if mask is None else self.label_index[rows][mask[rows]]
@@ -0,0 +1,89 @@
+import os
+import sqlite3
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from lib import metrics, sql
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    # requests has no session-wide timeout, so the adapter applies it to requests without one
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def make_session(pool_size=10, timeout=None):
+    session = requests.Session()
+    adapter = TimeoutHTTPAdapter(timeout=timeout, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class HostLimiter:
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.semaphores = {}
+
+    def __call__(self, url):
+        host = urllib.parse.urlparse(url).netloc
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.limit)
+            return self.semaphores[host]
+
+
+class AvailabilityCache:
+    def __init__(self, path, ttl):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('pragma journal_mode = WAL')
+        self.conn.execute('pragma synchronous = NORMAL')
+        self.conn.executescript(sql.create_table_url_availability())
+
+    def get(self, url):
+        with self.lock:
+            row = self.conn.execute(
+                *sql.select_url_availability(url, time.time() - self.ttl)
+            ).fetchone()
+        return bool(row[0]) if row else None
+
+    def set(self, url, response, available):
+        with self.lock:
+            self.conn.execute(*sql.replace_into_url_availability(
+                url,
+                response.status_code,
+                response.headers.get('Location'),
+                int(available),
+                time.time(),
+            ))
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def download_file(session, url, path, chunk_size=64 * 1024, allow_redirects=True):
+    with metrics.timer('http_get'), session.get(url, stream=True, allow_redirects=allow_redirects) as response:
+        if response.status_code != 200:
+            return response
+
+        tmp_path = f'{path}.part'
+        with open(tmp_path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                f.write(chunk)
+                metrics.inc('bytes_downloaded', len(chunk))
+        os.replace(tmp_path, path)
+    return response
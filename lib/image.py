@@ -0,0 +1,92 @@
+import os
+
+import cv2
+import numpy as np
+
+LETTERBOX_COLOR = (114, 114, 114)
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def resize_image(img_bgr, max_side, letterbox=False, color=LETTERBOX_COLOR):
+    """Shrinks img_bgr to fit max_side, or with letterbox scales and pads it to a max_side square.
+
+    Returns the image and, with letterbox, the normalized (x, y, width, height) of the content in it.
+    """
+    height, width = img_bgr.shape[:2]
+    scale = max_side / max(width, height)
+    if not letterbox:
+        scale = min(scale, 1.)
+
+    if scale != 1.:
+        size = (max(round(width * scale), 1), max(round(height * scale), 1))
+        img_bgr = cv2.resize(img_bgr, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+    if not letterbox:
+        return img_bgr, None
+
+    height, width = img_bgr.shape[:2]
+    left, top = (max_side - width) // 2, (max_side - height) // 2
+    img_bgr = cv2.copyMakeBorder(
+        img_bgr,
+        top,
+        max_side - height - top,
+        left,
+        max_side - width - left,
+        cv2.BORDER_CONSTANT,
+        value=color,
+    )
+    return img_bgr, (left / max_side, top / max_side, width / max_side, height / max_side)
+
+
+def read_image(path, max_side=None, size=None):
+    """Decodes path shrunk to fit max_side, or at full resolution without max_side.
+
+    With the (width, height) of the image, e.g. from lib.verify.probe_image, JPEG images are decoded at the
+    smallest 1/2, 1/4 or 1/8 scale that is still at least max_side, which is several times cheaper than a
+    full decode. Returns None when the image cannot be decoded.
+    """
+    flags = cv2.IMREAD_COLOR
+    if max_side and size:
+        for factor, reduced_flags in REDUCED_FLAGS:
+            if max(size) // factor >= max_side:
+                flags = reduced_flags
+                break
+
+    img_bgr = cv2.imread(path, flags)
+    if img_bgr is None or not max_side:
+        return img_bgr
+    return resize_image(img_bgr, max_side)[0]
+
+
+def crop_content(img_bgr, content):
+    """Cuts the content at the normalized (x, y, width, height) of resize_image out of a letterboxed image."""
+    height, width = img_bgr.shape[:2]
+    x, y, content_width, content_height = content
+    return img_bgr[
+        round(y * height):round((y + content_height) * height),
+        round(x * width):round((x + content_width) * width),
+    ]
+
+
+def decode_image(data, max_side=None):
+    """Decodes image bytes in memory, shrunk to fit max_side. Returns None when they cannot be decoded."""
+    img_bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img_bgr is None or not max_side:
+        return img_bgr
+    return resize_image(img_bgr, max_side)[0]
+
+
+def write_image(path, img_bgr, jpeg_quality=None):
+    ext = os.path.splitext(path)[1].lower()
+    params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality] if jpeg_quality and ext in ('.jpg', '.jpeg') else []
+    ok, buf = cv2.imencode(ext, img_bgr, params)
+    if not ok:
+        raise ValueError(f'Failed to encode {path}')
+
+    tmp_path = f'{path}.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(buf.tobytes())
+    os.replace(tmp_path, path)
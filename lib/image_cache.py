@@ -0,0 +1,143 @@
+import base64
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from lib import metrics, sql, link_file, md5sum
+
+
+class ImageCache:
+    """Image files keyed by image_id, bounded to max_size bytes by evicting the least recently used.
+
+    The index records the size and MD5 of each file. An image of the original size must match original_md5 to
+    be added, and a file whose size changed is dropped on lookup. Files are spread over subdirectories by the
+    first two characters of their name.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(cache_dir, 'index.sqlite'), check_same_thread=False)
+        self.conn.execute('pragma journal_mode = WAL')
+        self.conn.execute('pragma synchronous = NORMAL')
+        self.conn.executescript(sql.create_table_image_cache())
+        self.size = self.conn.execute(sql.select_image_cache_size()).fetchone()[0]
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, name[:2], name)
+
+    def get(self, image_id):
+        """Returns the path and type of the cached image, or (None, None)."""
+        with self.lock:
+            row = self.conn.execute(*sql.select_image_cache(image_id)).fetchone()
+            if row:
+                image_type, name, size = row
+                path = self.path(name)
+                if os.path.exists(path) and os.path.getsize(path) == size:
+                    self.conn.execute(*sql.update_image_cache_accessed_at(image_id, time.time()))
+                    self.conn.commit()
+                    metrics.inc('image_cache_hits')
+                    return path, image_type
+                self.remove(image_id, name, size)
+                self.conn.commit()
+        metrics.inc('image_cache_misses')
+        return None, None
+
+    def put(self, image_id, image_type, name, data, original_size=None, original_md5=None):
+        """Adds the image data, raising ValueError when it does not match original_md5."""
+        md5 = hashlib.md5(data).hexdigest()
+        check_original(len(data), md5, original_size, original_md5)
+
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self.add(image_id, image_type, name, len(data), md5)
+        return path
+
+    def put_file(self, image_id, image_type, src_path, original_size=None, original_md5=None):
+        """Adds the image file as a hardlink (or a copy), raising ValueError when it does not match original_md5."""
+        md5 = md5sum(src_path)
+        size = os.path.getsize(src_path)
+        check_original(size, md5, original_size, original_md5)
+
+        name = os.path.basename(src_path)
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if os.path.abspath(src_path) != os.path.abspath(path):
+            link_file(src_path, path, 'hardlink')
+        self.add(image_id, image_type, name, size, md5)
+        return path
+
+    def add(self, image_id, image_type, name, size, md5):
+        with self.lock:
+            row = self.conn.execute(*sql.select_image_cache(image_id)).fetchone()
+            if row:
+                # A replaced entry is only accounted for again, its file was overwritten unless it had another name
+                self.size -= row[2]
+                if row[1] != name:
+                    remove_file(self.path(row[1]))
+            self.conn.execute(*sql.replace_into_image_cache(image_id, image_type, name, size, md5, time.time()))
+            self.size += size
+            self.evict()
+            self.conn.commit()
+
+    def evict(self):
+        while self.size > self.max_size:
+            rows = self.conn.execute(*sql.select_image_cache_lru(100)).fetchall()
+            if not rows:
+                break
+            for image_id, name, size in rows:
+                self.remove(image_id, name, size)
+                metrics.inc('image_cache_evictions')
+                if self.size <= self.max_size:
+                    break
+
+    def remove(self, image_id, name, size):
+        self.conn.execute(*sql.delete_from_image_cache(image_id))
+        self.size -= size
+        remove_file(self.path(name))
+
+    def close(self):
+        self.conn.close()
+
+
+def check_original(size, md5, original_size, original_md5):
+    # original_md5 applies only to the original image, not to thumbnails
+    if original_md5 and size == original_size and md5 != base64.b64decode(original_md5).hex():
+        raise ValueError(f'MD5 {md5} does not match original_md5 {original_md5}')
+
+
+def remove_file(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--image-cache-size',
+        type=float,
+        metavar='GIB',
+        help='Size in GiB of the shared image cache (defaults to IMAGE_CACHE_SIZE)',
+    )
+    parser.add_argument(
+        '--without-image-cache',
+        action='store_true',
+        help='Neither look up nor add images in the shared image cache',
+    )
+
+
+def from_args(args, cache_dir, max_size):
+    if args.without_image_cache:
+        return None
+    if args.image_cache_size is not None:
+        max_size = int(args.image_cache_size * 1024 ** 3)
+    return ImageCache(cache_dir, max_size)
@@ -0,0 +1,213 @@
+import csv
+import os
+import sqlite3
+import time
+from contextlib import closing
+from functools import partial
+from itertools import islice
+
+from lib import logging, metrics, sql, sql_compact, md5sum, sql_schema, SCHEMAS
+
+JOURNAL_MODES = ['OFF', 'WAL']
+
+
+def table_kind(group, subgroup):
+    return subgroup if group == 'metadata' else group
+
+
+def set_import_pragmas(conn, journal_mode='WAL', cache_size=512):
+    conn.execute(f'pragma journal_mode = {journal_mode}')
+    conn.execute('pragma synchronous = OFF')
+    conn.execute(f'pragma cache_size = {-cache_size * 1024}')
+
+
+def iter_batches(rows, batch_size):
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class KeyEncoder:
+    """Assigns integer keys to label names and sources of the compact schema."""
+
+    def __init__(self, conn):
+        self.label_ids = dict(conn.execute(sql_compact.select_label_names()))
+        self.source_ids = dict(conn.execute(sql_compact.select_sources()))
+        self.new_labels = []
+        self.new_sources = []
+
+    def label(self, label_name):
+        if label_name not in self.label_ids:
+            self.label_ids[label_name] = len(self.label_ids) + 1
+            self.new_labels.append((self.label_ids[label_name], label_name))
+        return self.label_ids[label_name]
+
+    def source(self, source):
+        if source not in self.source_ids:
+            self.source_ids[source] = len(self.source_ids) + 1
+            self.new_sources.append((self.source_ids[source], source))
+        return self.source_ids[source]
+
+    def flush(self, conn):
+        # Written in the same transaction as the rows that use the new keys
+        conn.executemany(sql_compact.insert_into_label_names(), self.new_labels)
+        conn.executemany(sql_compact.insert_into_sources(), self.new_sources)
+        self.new_labels = []
+        self.new_sources = []
+
+
+def find_checkpoint(conn, table, path):
+    conn.executescript(sql.create_table_import_manifest())
+    row = conn.execute(*sql.select_import_manifest(table)).fetchone()
+    if not row:
+        return None
+
+    source_path, source_size, source_mtime, source_md5, imported_rows, completed = row
+    # Trust size and mtime, and fall back to the content hash when only mtime changed
+    stat = os.stat(path)
+    if source_size != stat.st_size:
+        return None
+    if source_path != path or source_mtime != stat.st_mtime:
+        if source_md5 != md5sum(path):
+            return None
+        conn.execute(*sql.update_import_manifest_source(table, path, stat.st_size, stat.st_mtime))
+        conn.commit()
+
+    return imported_rows, completed
+
+
+def import_csv(conn, kind, table, path, batch_size=50000, skip_rows=0, logger=None, schema=sql):
+    conn.executescript(schema.create_table_lookups())
+    conn.executescript(getattr(schema, f'create_table_{kind}')(table))
+
+    query = getattr(schema, f'insert_into_{kind}')(table)
+    encoder = KeyEncoder(conn) if schema is sql_compact else None
+    parse = partial(getattr(schema, f'parse_{kind}'), encoder=encoder)
+
+    # Without a journal a killed import may leave a partial batch behind, so its progress is not checkpointed
+    resumable = conn.execute('pragma journal_mode').fetchone()[0].lower() != 'off'
+
+    started_at = time.monotonic()
+    count = 0
+    with open(path, 'r', newline='') as f:
+        reader = csv.reader(f)
+        if kind != 'classes':
+            next(reader)
+        rows = map(parse, islice(reader, skip_rows, None))
+        for batch in iter_batches(rows, batch_size):
+            with metrics.timer('sql_insert_batch'):
+                if encoder:
+                    encoder.flush(conn)
+                conn.executemany(query, batch)
+                count += len(batch)
+                if resumable:
+                    conn.execute(*sql.update_import_manifest(table, skip_rows + count))
+                conn.commit()
+            metrics.inc('rows_imported', len(batch))
+    conn.execute(*sql.update_import_manifest(table, skip_rows + count, completed=1))
+    conn.commit()
+
+    elapsed = time.monotonic() - started_at
+    if logger:
+        logger.info(
+            f'Imported {count} rows to {table} in {elapsed:.1f}s '
+            f'({count / elapsed if elapsed else 0:.0f} rows/sec)'
+        )
+    return count
+
+
+def import_table(conn, kind, table, path, batch_size=50000, logger=None, schema=sql):
+    checkpoint = find_checkpoint(conn, table, path)
+    if checkpoint and checkpoint[1]:
+        if logger:
+            logger.info(f'{table} is up to date with {path}')
+        return False
+
+    # Checkpoints without progress, e.g. of imports with --journal-mode OFF, start over
+    if checkpoint and checkpoint[0]:
+        skip_rows = checkpoint[0]
+        if logger:
+            logger.info(f'Resuming import from {path} to {table} at row {skip_rows}')
+    else:
+        skip_rows = 0
+        if logger:
+            logger.info(f'Importing from {path} to {table}')
+        stat = os.stat(path)
+        conn.execute(f'drop table if exists {table}')
+        conn.execute(*sql.replace_into_import_manifest(
+            table, path, stat.st_size, stat.st_mtime, md5sum(path)
+        ))
+        conn.commit()
+
+    import_csv(conn, kind, table, path, batch_size=batch_size, skip_rows=skip_rows, logger=logger, schema=schema)
+    return True
+
+
+def create_indexes(conn, kind, table, logger=None, schema=sql):
+    started_at = time.monotonic()
+    with metrics.timer('sql_create_indexes'):
+        conn.executescript(getattr(schema, f'create_index_{kind}')(table))
+        conn.commit()
+    if logger:
+        logger.info(f'Created indexes on {table} in {time.monotonic() - started_at:.1f}s')
+
+
+def import_shard(task):
+    kind, table, path, shard_path, batch_size, journal_mode, cache_size, schema_name, loglevel = task
+
+    logger = logging.getLogger(__name__)
+    logger.setLevel(loglevel)
+
+    with closing(sqlite3.connect(shard_path)) as conn:
+        set_import_pragmas(conn, journal_mode=journal_mode, cache_size=cache_size)
+        import_table(conn, kind, table, path, batch_size=batch_size, logger=logger, schema=SCHEMAS[schema_name])
+
+    return kind, table, shard_path
+
+
+def merge_shard(conn, kind, table, shard_path, logger=None, schema=sql):
+    started_at = time.monotonic()
+    conn.executescript(sql.create_table_import_manifest())
+    conn.execute(f'drop table if exists {table}')
+    conn.executescript(getattr(schema, f'create_table_{kind}')(table))
+    conn.execute('attach database ? as shard', (shard_path,))
+    # Shard lookup keys are added to the main DB before the rows that reference them
+    conn.executescript(schema.merge_lookups())
+    conn.execute(schema.merge_into_table(kind, table))
+    conn.execute(
+        'insert or replace into main.import_manifest select * from shard.import_manifest where table_name = ?',
+        (table,)
+    )
+    conn.commit()
+    conn.execute('detach database shard')
+    os.remove(shard_path)
+    metrics.observe('sql_merge_shard', time.monotonic() - started_at)
+    if logger:
+        logger.info(f'Merged {shard_path} into {table} in {time.monotonic() - started_at:.1f}s')
+
+
+def materialize_annotations(conn, table, bboxes_table, labels_table, images_table, logger=None):
+    started_at = time.monotonic()
+    conn.executescript(
+        'begin;\n'
+        + sql_schema(conn).create_table_annotations(table, bboxes_table, labels_table, images_table)
+        + 'commit;\n'
+    )
+    metrics.observe('sql_materialize', time.monotonic() - started_at)
+    if logger:
+        logger.info(f'Materialized {table} in {time.monotonic() - started_at:.1f}s')
+
+
+def build_class_stats(conn, tables, bboxes_table, labels_table, logger=None):
+    started_at = time.monotonic()
+    conn.executescript(
+        'begin;\n'
+        + sql_schema(conn).create_temp_table_class_boxes(bboxes_table, labels_table)
+        + sql.create_tables_class_stats(tables['classes'], tables['pairs'], tables['box_sizes'])
+        + 'commit;\n'
+    )
+    metrics.observe('sql_class_stats', time.monotonic() - started_at)
+    if logger:
+        logger.info(f'Built {", ".join(tables.values())} in {time.monotonic() - started_at:.1f}s')
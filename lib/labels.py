@@ -0,0 +1,42 @@
+from itertools import groupby, islice
+from operator import itemgetter
+
+import numpy as np
+
+from lib.bbox import yolo_boxes
+
+BOXES_CHUNK_SIZE = 64
+
+
+class LabelsStream:
+    # Merge-joins labels ordered by image_id against images in the same order
+    def __init__(self, rows):
+        self.groups = groupby(rows, key=itemgetter(0))
+        self.current = next(self.groups, None)
+
+    def get(self, image_id):
+        while self.current and self.current[0] < image_id:
+            self.current = next(self.groups, None)
+        if self.current and self.current[0] == image_id:
+            return [row[1:] for row in self.current[1]]
+        return []
+
+
+def iter_yolo_boxes(items, chunk_size=BOXES_CHUNK_SIZE):
+    """Yields (item, boxes) for (item, labels, rotation), with the YOLO boxes of the labels as lists.
+
+    Labels are (class_name, x_min, y_min, x_max, y_max) rows. The few boxes of one image cost less than NumPy's
+    per-call overhead, so the boxes of chunk_size images are converted by one yolo_boxes call.
+    """
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, chunk_size))
+        if not chunk:
+            return
+        counts = [len(labels) for _, labels, _ in chunk]
+        rotation = np.repeat([rotation or 0 for _, _, rotation in chunk], counts)
+        boxes = yolo_boxes([label[1:] for _, labels, _ in chunk for label in labels], rotation).tolist()
+        start = 0
+        for (item, _, _), count in zip(chunk, counts):
+            yield item, boxes[start:start + count]
+            start += count
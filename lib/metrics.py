@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = 'open_images_'
+
+
+class Timer:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self):
+        return {'count': self.count, 'sum': self.total, 'max': self.max}
+
+
+class Metrics:
+    """Thread-safe counters, gauges and timers, cheap enough to update per image."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.timers = {}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        with self.lock:
+            if name not in self.timers:
+                self.timers[name] = Timer()
+            self.timers[name].observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started_at)
+
+    def timed_iter(self, name, iterable):
+        # Times each step of a lazy iterator, e.g. a SQLite cursor
+        iterator = iter(iterable)
+        while True:
+            started_at = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                self.observe(name, time.perf_counter() - started_at)
+            yield item
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'timers': {name: timer.as_dict() for name, timer in self.timers.items()},
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.timers.clear()
+
+
+metrics = Metrics()
+inc = metrics.inc
+gauge = metrics.gauge
+observe = metrics.observe
+timer = metrics.timer
+timed_iter = metrics.timed_iter
+
+
+def format_summary(snapshot):
+    parts = [f'{name}={value}' for name, value in sorted(snapshot['counters'].items())]
+    parts += [f'{name}={value}' for name, value in sorted(snapshot['gauges'].items())]
+    for name, timer in sorted(snapshot['timers'].items()):
+        mean = timer['sum'] / timer['count'] if timer['count'] else 0
+        parts.append(f'{name}: n={timer["count"]} avg={mean * 1000:.1f}ms max={timer["max"] * 1000:.1f}ms')
+    return ' '.join(parts)
+
+
+def format_prometheus(snapshot, script):
+    labels = f'{{script="{script}"}}'
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        lines += [f'# TYPE {PROMETHEUS_PREFIX}{name}_total counter', f'{PROMETHEUS_PREFIX}{name}_total{labels} {value}']
+    for name, value in sorted(snapshot['gauges'].items()):
+        lines += [f'# TYPE {PROMETHEUS_PREFIX}{name} gauge', f'{PROMETHEUS_PREFIX}{name}{labels} {value}']
+    for name, timer in sorted(snapshot['timers'].items()):
+        metric = f'{PROMETHEUS_PREFIX}{name}_seconds'
+        lines += [
+            f'# TYPE {metric} summary',
+            f'{metric}_count{labels} {timer["count"]}',
+            f'{metric}_sum{labels} {timer["sum"]}',
+            f'# TYPE {metric}_max gauge',
+            f'{metric}_max{labels} {timer["max"]}',
+        ]
+    return ''.join(f'{line}\n' for line in lines)
+
+
+class MetricsReporter:
+    """Logs a summary of the metrics every interval seconds and optionally writes them out.
+
+    The Prometheus textfile is replaced atomically on every report, JSON lines are appended.
+    """
+
+    def __init__(self, script, logger, interval=60, prometheus_path=None, jsonl_path=None, registry=metrics):
+        self.script = script
+        self.logger = logger
+        self.interval = interval
+        self.prometheus_path = prometheus_path
+        self.jsonl_path = jsonl_path
+        self.registry = registry
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def report(self):
+        snapshot = self.registry.snapshot()
+        self.logger.info(f'[metrics] {format_summary(snapshot)}')
+
+        if self.prometheus_path:
+            tmp_path = f'{self.prometheus_path}.tmp'
+            with open(tmp_path, 'w') as f:
+                f.write(format_prometheus(snapshot, self.script))
+            os.replace(tmp_path, self.prometheus_path)
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a') as f:
+                f.write(json.dumps({'time': time.time(), 'script': self.script, **snapshot}) + '\n')
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def start(self):
+        if self.interval:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+        self.report()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def add_arguments(parser):
+    parser.add_argument(
+        '--metrics-interval',
+        type=float,
+        default=60,
+        help='Seconds between metrics summaries (0 for only a final summary)',
+    )
+    parser.add_argument(
+        '--metrics-prometheus',
+        type=str,
+        metavar='PATH',
+        help='Write metrics to a Prometheus textfile collector file',
+    )
+    parser.add_argument(
+        '--metrics-jsonl',
+        type=str,
+        metavar='PATH',
+        help='Append metrics as JSON lines',
+    )
+
+
+def reporter(script, args, logger):
+    return MetricsReporter(
+        script,
+        logger,
+        interval=args.metrics_interval,
+        prometheus_path=args.metrics_prometheus,
+        jsonl_path=args.metrics_jsonl,
+    )
@@ -0,0 +1,137 @@
+import queue
+import threading
+import time
+
+from lib import logging, metrics
+
+_DONE = object()
+
+
+class Stage:
+    """A pool of worker threads applying func to items from a bounded input queue.
+
+    func returns the item passed on to the next stage, or None to drop it. Items whose func raises are
+    logged and dropped.
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=None):
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.input = queue.Queue(maxsize=queue_size or workers * 2)
+        self.output = None
+        self.consumers = 1
+
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.finished = 0
+
+    def run(self):
+        logger = logging.getLogger(__name__)
+        while True:
+            item = self.input.get()
+            if item is _DONE:
+                # Each worker gets one, and the last one to stop passes one on to each consumer
+                with self.lock:
+                    self.finished += 1
+                    last = self.finished == self.workers
+                if last:
+                    for _ in range(self.consumers):
+                        self.output.put(_DONE)
+                return
+
+            started_at = time.monotonic()
+            failed = False
+            try:
+                result = self.func(item)
+            except Exception:
+                logger.exception(f'[{self.name}] Failed to process {item}')
+                result = None
+                failed = True
+            busy = time.monotonic() - started_at
+            with self.lock:
+                self.processed += 1
+                self.failed += failed
+                self.busy += busy
+            metrics.observe(f'stage_{self.name}', busy)
+            if failed:
+                metrics.inc(f'stage_{self.name}_failed')
+
+            if result is not None:
+                self.output.put(result)
+
+    def stats(self, elapsed):
+        with self.lock:
+            return (
+                f'{self.name}: {self.processed} done ({self.processed / elapsed if elapsed else 0:.1f}/s), '
+                f'{self.failed} failed, busy {self.busy / (elapsed * self.workers) if elapsed else 0:.0%} '
+                f'of {self.workers} workers, queue {self.input.qsize()}/{self.input.maxsize}'
+            )
+
+
+class Pipeline:
+    """Streams items through stages connected by bounded queues and yields the results of the last stage.
+
+    Results come out in completion order, not input order.
+    """
+
+    def __init__(self, stages, stats_interval=None, logger=None):
+        self.stages = stages
+        self.stats_interval = stats_interval
+        self.logger = logger
+        self.error = None
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.output = next_stage.input
+            stage.consumers = next_stage.workers
+        stages[-1].output = queue.Queue(maxsize=stages[-1].input.maxsize)
+
+    def feed(self, items):
+        try:
+            for item in items:
+                self.stages[0].input.put(item)
+        except Exception as e:
+            self.error = e
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.stages[0].input.put(_DONE)
+
+    def log_stats(self, started_at):
+        for stage in self.stages:
+            metrics.gauge(f'stage_{stage.name}_queue', stage.input.qsize())
+        if self.logger:
+            elapsed = time.monotonic() - started_at
+            for stage in self.stages:
+                self.logger.info(f'[pipeline] {stage.stats(elapsed)}')
+
+    def run(self, items):
+        started_at = time.monotonic()
+        logged_at = started_at
+
+        threads = [threading.Thread(target=self.feed, args=(items,), daemon=True)]
+        for stage in self.stages:
+            threads += [threading.Thread(target=stage.run, daemon=True) for _ in range(stage.workers)]
+        for thread in threads:
+            thread.start()
+
+        output = self.stages[-1].output
+        while True:
+            try:
+                item = output.get(timeout=self.stats_interval)
+            except queue.Empty:
+                pass
+            else:
+                if item is _DONE:
+                    break
+                yield item
+
+            if self.stats_interval and time.monotonic() - logged_at >= self.stats_interval:
+                self.log_stats(started_at)
+                logged_at = time.monotonic()
+
+        for thread in threads:
+            thread.join()
+        self.log_stats(started_at)
+        if self.error:
+            raise self.error
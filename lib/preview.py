@@ -0,0 +1,48 @@
+import cv2
+import numpy as np
+
+MOSAIC_BACKGROUND = (32, 32, 32)
+
+
+def draw_boxes(img_bgr, class_names, pixel_boxes, class_ids, colors):
+    for class_name, class_id, (left, top, right, bottom) in zip(class_names, class_ids, pixel_boxes.tolist()):
+        color = colors[class_id % len(colors)]
+
+        cv2.rectangle(img_bgr, (left, top), (right, bottom), color, 1)
+        cv2.putText(
+            img_bgr,
+            class_name,
+            (left, top + 12),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            .5,
+            color,
+            lineType=cv2.LINE_AA
+        )
+    return img_bgr
+
+
+def make_tile(img_bgr, tile_size, caption, color=(255, 255, 255), background=MOSAIC_BACKGROUND):
+    # img_bgr fits in tile_size and is centered on a square with the caption at the bottom
+    height, width = img_bgr.shape[:2]
+    top, left = (tile_size - height) // 2, (tile_size - width) // 2
+    tile = cv2.copyMakeBorder(
+        img_bgr,
+        top,
+        tile_size - height - top,
+        left,
+        tile_size - width - left,
+        cv2.BORDER_CONSTANT,
+        value=background,
+    )
+    cv2.putText(tile, caption, (4, tile_size - 6), cv2.FONT_HERSHEY_SIMPLEX, .4, color, lineType=cv2.LINE_AA)
+    return tile
+
+
+def make_mosaic(tiles, columns, background=MOSAIC_BACKGROUND):
+    tile_size = tiles[0].shape[0]
+    rows = -(-len(tiles) // columns)
+    mosaic = np.full((rows * tile_size, min(len(tiles), columns) * tile_size, 3), background, dtype=np.uint8)
+    for i, tile in enumerate(tiles):
+        row, column = divmod(i, columns)
+        mosaic[row * tile_size:(row + 1) * tile_size, column * tile_size:(column + 1) * tile_size] = tile
+    return mosaic
@@ -0,0 +1,129 @@
+import glob
+import io
+import os
+import tarfile
+import threading
+
+SHARD_PATTERN = '{prefix}-{number:06d}.tar'
+
+
+def shard_paths(shards_dir):
+    return sorted(glob.glob(os.path.join(shards_dir, '*.tar')))
+
+
+def index_path(shard_path):
+    return f'{shard_path}.idx'
+
+
+def read_index(shard_path):
+    """Returns {(key, ext): (offset, size)} of the member data in a shard."""
+    index = {}
+    with open(index_path(shard_path), 'r') as f:
+        for line in f:
+            key, ext, offset, size = line.rstrip('\n').split('\t')
+            index[key, ext] = int(offset), int(size)
+    return index
+
+
+class ShardWriter:
+    """Packs samples of (key, {ext: bytes}) into WebDataset-style tar shards of about max_size bytes.
+
+    Each finished shard has a tab separated index of the data offset and size of its members.
+    """
+
+    def __init__(self, shards_dir, prefix, max_size):
+        self.shards_dir = shards_dir
+        self.prefix = prefix
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.number = len(shard_paths(shards_dir))
+        self.tar = None
+        self.index = []
+        os.makedirs(shards_dir, exist_ok=True)
+
+    @property
+    def path(self):
+        return os.path.join(self.shards_dir, SHARD_PATTERN.format(prefix=self.prefix, number=self.number))
+
+    def open(self):
+        self.tar = tarfile.open(f'{self.path}.part', 'w', format=tarfile.USTAR_FORMAT)
+        self.index = []
+
+    def finish(self):
+        if self.tar is None:
+            return
+        self.tar.close()
+        with open(f'{index_path(self.path)}.part', 'w') as f:
+            f.writelines(f'{key}\t{ext}\t{offset}\t{size}\n' for key, ext, offset, size in self.index)
+        os.replace(f'{index_path(self.path)}.part', index_path(self.path))
+        os.replace(f'{self.path}.part', self.path)
+        self.tar = None
+        self.number += 1
+
+    def write(self, key, files):
+        with self.lock:
+            if self.tar is None:
+                self.open()
+            for ext, data in files.items():
+                info = tarfile.TarInfo(f'{key}.{ext}')
+                info.size = len(data)
+                self.tar.addfile(info, io.BytesIO(data))
+                # The data ends at the current offset, padded to a block
+                padded_size = -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                self.index.append((key, ext, self.tar.offset - padded_size, len(data)))
+            if self.tar.offset >= self.max_size:
+                self.finish()
+
+    def close(self):
+        with self.lock:
+            self.finish()
+
+
+class ShardReader:
+    """Random access to the members of a tar shard through its index."""
+
+    def __init__(self, shard_path):
+        self.path = shard_path
+        self.index = read_index(shard_path)
+        self.f = open(shard_path, 'rb')
+
+    def keys(self):
+        return list(dict.fromkeys(key for key, _ in self.index))
+
+    def read(self, key, ext):
+        offset, size = self.index[key, ext]
+        self.f.seek(offset)
+        return self.f.read(size)
+
+    def __iter__(self):
+        # Sequential scan, grouping consecutive members by key
+        with tarfile.open(self.path, 'r') as tar:
+            key, files = None, {}
+            for info in tar:
+                name, ext = info.name.split('.', 1)
+                if name != key and files:
+                    yield key, files
+                    files = {}
+                key = name
+                files[ext] = tar.extractfile(info).read()
+            if files:
+                yield key, files
+
+    def close(self):
+        self.f.close()
+
+
+def iter_samples(shards_dir):
+    for shard_path in shard_paths(shards_dir):
+        reader = ShardReader(shard_path)
+        try:
+            yield from reader
+        finally:
+            reader.close()
+
+
+def packed_keys(shards_dir):
+    keys = set()
+    for shard_path in shard_paths(shards_dir):
+        keys.update(key for key, _ in read_index(shard_path))
+    return keys
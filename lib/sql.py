@@ -1,19 +1,86 @@
+BOX_SIZE_BUCKETS = 10
+
+
+def create_table_import_manifest():
+    return '''\
+create table if not exists import_manifest (
+  table_name text primary key,
+  source_path text,
+  source_size int,
+  source_mtime float,
+  source_md5 text,
+  imported_rows int,
+  completed int
+);
+'''
+
+
+def select_import_manifest(table):
+    return '''\
+select
+  source_path,
+  source_size,
+  source_mtime,
+  source_md5,
+  imported_rows,
+  completed
+from
+  import_manifest
+where
+  table_name = ?
+''', [table]
+
+
+def replace_into_import_manifest(table, source_path, source_size, source_mtime, source_md5):
+    return '''\
+insert or replace into import_manifest (
+  table_name,
+  source_path,
+  source_size,
+  source_mtime,
+  source_md5,
+  imported_rows,
+  completed
+) values (?, ?, ?, ?, ?, 0, 0)
+''', [table, source_path, source_size, source_mtime, source_md5]
+
+
+def update_import_manifest(table, imported_rows, completed=0):
+    return '''\
+update import_manifest set imported_rows = ?, completed = ? where table_name = ?
+''', [imported_rows, completed, table]
+
+
+def update_import_manifest_source(table, source_path, source_size, source_mtime):
+    return '''\
+update import_manifest set source_path = ?, source_size = ?, source_mtime = ? where table_name = ?
+''', [source_path, source_size, source_mtime, table]
+
+
 def create_table_classes(table):
     return f'''\
-create table {table} (
+create table if not exists {table} (
   label_name text,
   class_name text
 );
 '''
 
 
-def insert_into_classes(table, params):
+def create_index_classes(table):
+    return ''
+
+
+def insert_into_classes(table):
     return f'''\
 insert into {table} (label_name, class_name) values (?, ?)
-''', [
-    params[0] if params[0] else None,
-    params[1] if params[1] else None,
-]
+'''
+
+
+def parse_classes(params, encoder=None):
+    return [
+        params[0] if params[0] else None,
+        params[1] if params[1] else None,
+    ]
 
 
 def create_table_bboxes(table):
@@ -33,13 +100,18 @@ create table if not exists {table} (
   is_depiction int,
   is_inside int
 );
+'''
+
+
+def create_index_bboxes(table):
+    return f'''\
 create index if not exists {table}_image_id on {table}(image_id);
 create index if not exists {table}_label_name on {table}(label_name);
 create index if not exists {table}_image_id_and_label_name on {table}(image_id, label_name);
 '''
 
 
-def insert_into_bboxes(table, params):
+def insert_into_bboxes(table):
     return f'''\
 insert into {table} (
   image_id,
@@ -56,21 +128,25 @@ insert into {table} (
   is_depiction,
   is_inside
 ) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-''', [
-    params[0] if params[0] else None,
-    params[1] if params[1] else None,
-    params[2] if params[2] else None,
-    float(params[3]) if params[3] else None,
-    float(params[4]) if params[4] else None,
-    float(params[5]) if params[5] else None,
-    float(params[6]) if params[6] else None,
-    float(params[7]) if params[7] else None,
-    int(params[8]) if params[8] else None,
-    int(params[9]) if params[9] else None,
-    int(params[10]) if params[10] else None,
-    int(params[11]) if params[11] else None,
-    int(params[12]) if params[12] else None,
-]
+'''
+
+
+def parse_bboxes(params, encoder=None):
+    return [
+        params[0] if params[0] else None,
+        params[1] if params[1] else None,
+        params[2] if params[2] else None,
+        float(params[3]) if params[3] else None,
+        float(params[4]) if params[4] else None,
+        float(params[5]) if params[5] else None,
+        float(params[6]) if params[6] else None,
+        float(params[7]) if params[7] else None,
+        int(params[8]) if params[8] else None,
+        int(params[9]) if params[9] else None,
+        int(params[10]) if params[10] else None,
+        int(params[11]) if params[11] else None,
+        int(params[12]) if params[12] else None,
+    ]
 
 
 def create_table_labels(table):
@@ -81,6 +157,11 @@ create table if not exists {table} (
   label_name text,
   confidence float
 );
+'''
+
+
+def create_index_labels(table):
+    return f'''\
 create index if not exists {table}_image_id on {table}(image_id);
 create index if not exists {table}_source on {table}(source);
 create index if not exists {table}_label_name on {table}(label_name);
@@ -89,7 +170,7 @@ create index if not exists {table}_image_id_and_label_name on {table}(image_id,
 '''
 
 
-def insert_into_labels(table, params):
+def insert_into_labels(table):
     return f'''\
 insert into {table} (
   image_id,
@@ -97,12 +178,16 @@ insert into {table} (
   label_name,
   confidence
 ) values (?, ?, ?, ?)
-''', [
-    params[0] if params[0] else None,
-    params[1] if params[1] else None,
-    params[2] if params[2] else None,
-    float(params[3]) if params[3] else None,
-]
+'''
+
+
+def parse_labels(params, encoder=None):
+    return [
+        params[0] if params[0] else None,
+        params[1] if params[1] else None,
+        params[2] if params[2] else None,
+        float(params[3]) if params[3] else None,
+    ]
 
 
 def create_table_images(table):
@@ -121,11 +206,16 @@ create table if not exists {table} (
   thumbnail_300k_url text,
   rotation float
 );
+'''
+
+
+def create_index_images(table):
+    return f'''\
 create index if not exists {table}_image_id on {table}(image_id);
 '''
 
 
-def insert_into_images(table, params):
+def insert_into_images(table):
     return f'''\
 insert into {table} (
   image_id,
@@ -141,24 +231,312 @@ insert into {table} (
   thumbnail_300k_url,
   rotation
 ) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-''', [
-    params[0] if params[0] else None,
-    params[1] if params[1] else None,
-    params[2] if params[2] else None,
-    params[3] if params[3] else None,
-    params[4] if params[4] else None,
-    params[5] if params[5] else None,
-    params[6] if params[6] else None,
-    params[7] if params[7] else None,
-    int(params[8]) if params[8] else None,
-    params[9] if params[9] else None,
-    params[10] if params[10] else None,
-    float(params[11]) if params[11] != '' else None,
-]
+'''
+
+
+def parse_images(params, encoder=None):
+    return [
+        params[0] if params[0] else None,
+        params[1] if params[1] else None,
+        params[2] if params[2] else None,
+        params[3] if params[3] else None,
+        params[4] if params[4] else None,
+        params[5] if params[5] else None,
+        params[6] if params[6] else None,
+        params[7] if params[7] else None,
+        int(params[8]) if params[8] else None,
+        params[9] if params[9] else None,
+        params[10] if params[10] else None,
+        float(params[11]) if params[11] != '' else None,
+    ]
+
+
+def create_table_annotations(table, bboxes_table, labels_table, images_table):
+    return f'''\
+drop table if exists {table};
+create table {table} as
+select
+  bboxes.image_id,
+  bboxes.label_name,
+  classes.class_name,
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max,
+  images.original_url,
+  images.thumbnail_300k_url,
+  images.rotation,
+  images.original_size,
+  images.original_md5
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image_id = labels.image_id and bboxes.label_name = labels.label_name
+  join {images_table} as images
+    on bboxes.image_id = images.image_id
+  join classes
+    on labels.label_name = classes.label_name
+where
+  bboxes.is_group_of = 0
+  and labels.confidence = 1
+order by
+  bboxes.image_id
+;
+create index if not exists {table}_image_id on {table}(image_id);
+create index if not exists {table}_class_name_and_image_id on {table}(class_name, image_id);
+'''
+
+
+def box_size_bucket(column, buckets=BOX_SIZE_BUCKETS):
+    # Buckets of the square root of the relative box area, without SQLite's optional math functions
+    cases = ' '.join(f'when {column} < {((i + 1) / buckets) ** 2!r} then {i}' for i in range(buckets - 1))
+    return f'case {cases} else {buckets - 1} end'
+
+
+def create_temp_table_class_boxes(bboxes_table, labels_table):
+    return f'''\
+drop table if exists temp.class_boxes;
+create temp table class_boxes as
+select
+  bboxes.image_id as image,
+  classes.rowid as class_id,
+  (bboxes.x_max - bboxes.x_min) * (bboxes.y_max - bboxes.y_min) as area
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image_id = labels.image_id and bboxes.label_name = labels.label_name
+  join classes
+    on labels.label_name = classes.label_name
+where
+  bboxes.is_group_of = 0
+  and labels.confidence = 1
+;
+'''
+
+
+def create_tables_class_stats(classes_table, pairs_table, box_sizes_table):
+    return f'''\
+drop table if exists {classes_table};
+create table {classes_table} as
+select
+  classes.label_name,
+  classes.class_name,
+  count(*) as boxes,
+  count(distinct class_boxes.image) as images
+from
+  temp.class_boxes as class_boxes
+  join classes
+    on class_boxes.class_id = classes.rowid
+group by
+  class_boxes.class_id
+;
+create index if not exists {classes_table}_class_name on {classes_table}(class_name);
+
+drop table if exists temp.class_images;
+create temp table class_images as
+select distinct image, class_id from temp.class_boxes;
+create index temp.class_images_image_and_class_id on class_images(image, class_id);
+
+drop table if exists {pairs_table};
+create table {pairs_table} as
+select
+  classes.class_name,
+  other_classes.class_name as other_class_name,
+  count(*) as images
+from
+  temp.class_images as a
+  join temp.class_images as b
+    on a.image = b.image and a.class_id < b.class_id
+  join classes
+    on a.class_id = classes.rowid
+  join classes as other_classes
+    on b.class_id = other_classes.rowid
+group by
+  a.class_id,
+  b.class_id
+;
+create index if not exists {pairs_table}_class_name on {pairs_table}(class_name, other_class_name);
+
+drop table if exists {box_sizes_table};
+create table {box_sizes_table} as
+select
+  classes.class_name,
+  {box_size_bucket('class_boxes.area')} as size_bucket,
+  count(*) as boxes
+from
+  temp.class_boxes as class_boxes
+  join classes
+    on class_boxes.class_id = classes.rowid
+group by
+  class_boxes.class_id,
+  size_bucket
+;
+create index if not exists {box_sizes_table}_class_name on {box_sizes_table}(class_name);
+
+drop table temp.class_images;
+drop table temp.class_boxes;
+'''
+
+
+def select_class_stats(classes_table, class_names=None):
+    params = []
+    where_clause = ''
+    if class_names:
+        where_clause = f"where class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+
+    return f'''\
+select class_name, boxes, images from {classes_table}
+{where_clause}
+order by images, class_name
+''', params
+
+
+def select_class_pairs(pairs_table):
+    return f'''\
+select class_name, other_class_name, images from {pairs_table}
+'''
+
+
+def select_class_box_sizes(box_sizes_table):
+    return f'''\
+select class_name, size_bucket, boxes from {box_sizes_table}
+'''
+
+
+def select_class_image_labels(
+    bboxes_table,
+    labels_table,
+    class_name,
+    class_names=None,
+    min_box_size=0,
+    annotations_table=None
+):
+    if annotations_table:
+        return select_class_image_labels_from_annotations(
+            annotations_table,
+            class_name,
+            class_names=class_names,
+            min_box_size=min_box_size,
+        )
+
+    # The boxes of class_name select the images, and the boxes of class_names in them are returned
+    box_filter = 'bboxes.is_group_of = 0 and +labels.confidence = 1'
+    params = [class_name]
+    if min_box_size:
+        box_filter += ' and (bboxes.x_max - bboxes.x_min) * (bboxes.y_max - bboxes.y_min) >= ?'
+        params.append(min_box_size ** 2)
+    where_clause = f'where bboxes.image_id in (select image_id from images) and {box_filter}'
+    params += params[1:]
+    if class_names:
+        where_clause += f" and classes.class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+
+    return f'''\
+with images as (
+  select
+    bboxes.image_id
+  from
+    {bboxes_table} as bboxes
+    join {labels_table} as labels
+      on bboxes.image_id = labels.image_id and bboxes.label_name = labels.label_name
+    join classes
+      on labels.label_name = classes.label_name
+  where
+    classes.class_name = ?
+    and {box_filter}
+)
+select
+  bboxes.image_id,
+  classes.class_name
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image_id = labels.image_id and bboxes.label_name = labels.label_name
+  join classes
+    on labels.label_name = classes.label_name
+{where_clause}
+order by
+  bboxes.image_id
+;
+''', params
+
+
+def select_class_image_labels_from_annotations(annotations_table, class_name, class_names=None, min_box_size=0):
+    box_filter = '1'
+    params = [class_name]
+    if min_box_size:
+        box_filter = '(x_max - x_min) * (y_max - y_min) >= ?'
+        params.append(min_box_size ** 2)
+    where_clause = f'where image_id in (select image_id from images) and {box_filter}'
+    params += params[1:]
+    if class_names:
+        where_clause += f" and class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+
+    return f'''\
+with images as (
+  select image_id from {annotations_table} where class_name = ? and {box_filter}
+)
+select
+  image_id,
+  class_name
+from
+  {annotations_table}
+{where_clause}
+order by
+  image_id
+;
+''', params
+
+
+def select_columnar_bboxes(bboxes_table, labels_table):
+    return f'''\
+select
+  bboxes.image_id,
+  bboxes.label_name,
+  bboxes.confidence,
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max,
+  bboxes.is_occluded,
+  bboxes.is_truncated,
+  bboxes.is_group_of,
+  bboxes.is_depiction,
+  bboxes.is_inside,
+  exists (
+    select 1 from {labels_table} as labels
+    where labels.image_id = bboxes.image_id and labels.label_name = bboxes.label_name and +labels.confidence = 1
+  ) as verified
+from
+  {bboxes_table} as bboxes
+order by
+  bboxes.image_id
+;
+'''
+
+
+def select_class_box_counts(bboxes_table, labels_table):
+    return f'''\
+select
+  bboxes.label_name,
+  count(*)
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image_id = labels.image_id and bboxes.label_name = labels.label_name
+where
+  bboxes.is_group_of = 0
+  and +labels.confidence = 1
+group by
+  bboxes.label_name
+;
+'''
 
 
 def select_classes():
-    return 'select * from classes'
+    return 'select label_name, class_name from classes order by rowid'
 
 
 def select_images(
@@ -168,26 +546,50 @@ def select_images(
     image_id=None,
     class_names=None,
     limit=None,
-    offset=0
+    offset=0,
+    annotations_table=None,
+    after_image_id=None,
+    shard=None
 ):
+    if annotations_table:
+        return select_images_from_annotations(
+            annotations_table,
+            image_id=image_id,
+            class_names=class_names,
+            limit=limit,
+            offset=offset,
+            after_image_id=after_image_id,
+            shard=shard,
+        )
+
     params = []
 
-    where_clause = 'where bboxes.is_group_of = 0 and labels.confidence = 1'
+    # The unary + keeps the labels confidence index from driving the join, so it streams in bboxes image_id order
+    where_clause = 'where bboxes.is_group_of = 0 and +labels.confidence = 1'
     if image_id:
         where_clause += ' and bboxes.image_id = ?'
         params.append(image_id)
+    if after_image_id:
+        where_clause += ' and bboxes.image_id > ?'
+        params.append(after_image_id)
+    if shard:
+        where_clause += ' and image_shard(bboxes.image_id, ?) = ?'
+        params += [shard[1], shard[0]]
     if class_names:
         where_clause += f" and classes.class_name in ({','.join(['?'] * len(class_names))})"
         params += class_names if class_names else []
 
     limit_clause = f'limit {limit} offset {offset}' if limit else ''
 
+    # URLs and rotation depend only on image_id, so grouping streams in index order without distinct
     return f'''\
 select
-  distinct bboxes.image_id,
+  bboxes.image_id,
   images.original_url,
   images.thumbnail_300k_url,
-  images.rotation
+  images.rotation,
+  images.original_size,
+  images.original_md5
 from
   {bboxes_table} as bboxes
   join {labels_table} as labels
@@ -197,12 +599,81 @@ from
   join classes
     on labels.label_name = classes.label_name
 {where_clause}
+group by
+  bboxes.image_id
+order by
+  bboxes.image_id
+{limit_clause}
+;
+''', params
+
+
+def select_image(images_table, image_id):
+    return f'''\
+select image_id, original_url, thumbnail_300k_url, rotation, original_size, original_md5
+from {images_table} where image_id = ?
+''', [image_id]
+
+
+def select_images_from_annotations(
+    annotations_table,
+    image_id=None,
+    class_names=None,
+    limit=None,
+    offset=0,
+    after_image_id=None,
+    shard=None
+):
+    params = []
+
+    where_clause = 'where 1'
+    if image_id:
+        where_clause += ' and image_id = ?'
+        params.append(image_id)
+    if after_image_id:
+        where_clause += ' and image_id > ?'
+        params.append(after_image_id)
+    if shard:
+        where_clause += ' and image_shard(image_id, ?) = ?'
+        params += [shard[1], shard[0]]
+    if class_names:
+        where_clause += f" and class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+
+    limit_clause = f'limit {limit} offset {offset}' if limit else ''
+
+    # URLs and rotation depend only on image_id, so grouping streams in index order without distinct
+    return f'''\
+select
+  image_id,
+  original_url,
+  thumbnail_300k_url,
+  rotation,
+  original_size,
+  original_md5
+from
+  {annotations_table}
+{where_clause}
+group by
+  image_id
+order by
+  image_id
 {limit_clause}
 ;
 ''', params
 
 
-def select_labels(bboxes_table, labels_table, image_id, class_names=None, confidence=1):
+def select_labels(
+    bboxes_table,
+    labels_table,
+    image_id,
+    class_names=None,
+    confidence=1,
+    annotations_table=None
+):
+    if annotations_table:
+        return select_labels_from_annotations(annotations_table, image_id=image_id, class_names=class_names)
+
     if class_names:
         class_names_cond = f"and classes.class_name in ({','.join(['?'] * len(class_names))})"
     else:
@@ -211,10 +682,10 @@ def select_labels(bboxes_table, labels_table, image_id, class_names=None, confid
     return f'''\
 select
   classes.class_name,
-  bboxes.x_min + (bboxes.x_max - bboxes.x_min) / 2 as x,
-  bboxes.y_min + (bboxes.y_max - bboxes.y_min) / 2 as y,
-  (bboxes.x_max - bboxes.x_min) as width,
-  (bboxes.y_max - bboxes.y_min) as height
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max
 from
   {bboxes_table} as bboxes
   join {labels_table} as labels
@@ -228,3 +699,301 @@ where
   and bboxes.is_group_of = 0
 ;
 ''', [image_id, *(class_names if class_names else []), confidence]
+
+
+def create_table_url_availability():
+    return '''\
+create table if not exists url_availability (
+  url text primary key,
+  status_code int,
+  location text,
+  available int,
+  checked_at float
+);
+'''
+
+
+def select_url_availability(url, checked_after):
+    return '''\
+select available from url_availability where url = ? and checked_at >= ?
+''', [url, checked_after]
+
+
+def replace_into_url_availability(url, status_code, location, available, checked_at):
+    return '''\
+insert or replace into url_availability (
+  url,
+  status_code,
+  location,
+  available,
+  checked_at
+) values (?, ?, ?, ?, ?)
+''', [url, status_code, location, available, checked_at]
+
+
+def select_labels_by_image(
+    bboxes_table,
+    labels_table,
+    class_names=None,
+    confidence=1,
+    from_image_id=None,
+    annotations_table=None
+):
+    if annotations_table:
+        return select_labels_from_annotations(
+            annotations_table,
+            class_names=class_names,
+            from_image_id=from_image_id,
+            with_image_id=True,
+        )
+
+    params = []
+
+    # As in select_images, the unary + keeps --after resumes (from_image_id) seeking the bboxes image_id index
+    where_clause = 'where +labels.confidence >= ? and bboxes.is_group_of = 0'
+    params.append(confidence)
+    if class_names:
+        where_clause += f" and classes.class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+    if from_image_id:
+        where_clause += ' and bboxes.image_id >= ?'
+        params.append(from_image_id)
+
+    return f'''\
+select
+  bboxes.image_id,
+  classes.class_name,
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image_id = labels.image_id and bboxes.label_name = labels.label_name
+  join classes
+    on labels.label_name = classes.label_name
+{where_clause}
+order by
+  bboxes.image_id
+;
+''', params
+
+
+def select_labels_from_annotations(
+    annotations_table,
+    image_id=None,
+    class_names=None,
+    from_image_id=None,
+    with_image_id=False
+):
+    params = []
+
+    where_clause = 'where 1'
+    if image_id:
+        where_clause += ' and image_id = ?'
+        params.append(image_id)
+    if class_names:
+        where_clause += f" and class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+    if from_image_id:
+        where_clause += ' and image_id >= ?'
+        params.append(from_image_id)
+
+    return f'''\
+select
+  {'image_id,' if with_image_id else ''}
+  class_name,
+  x_min,
+  y_min,
+  x_max,
+  y_max
+from
+  {annotations_table}
+{where_clause}
+order by
+  image_id
+;
+''', params
+
+
+def select_table_exists(table):
+    return "select 1 from sqlite_master where type = 'table' and name = ?", [table]
+
+
+def select_table_columns(table):
+    return 'select name from pragma_table_info(?)', [table]
+
+
+def create_table_lookups():
+    return ''
+
+
+def merge_lookups():
+    return ''
+
+
+def merge_into_table(kind, table):
+    return f'insert into main.{table} select * from shard.{table}'
+
+
+def select_image_md5s(images_table, image_ids):
+    return f'''\
+select image_id, original_size, original_md5 from {images_table}
+where image_id in ({','.join(['?'] * len(image_ids))})
+''', list(image_ids)
+
+
+def create_table_verified_images():
+    return '''\
+create table if not exists verified_images (
+  path text primary key,
+  size int,
+  mtime float,
+  status text,
+  error text
+);
+'''
+
+
+def select_verified_image(path, size, mtime):
+    return '''\
+select status, error from verified_images where path = ? and size = ? and mtime = ?
+''', [path, size, mtime]
+
+
+def replace_into_verified_images(path, size, mtime, status, error):
+    return '''\
+insert or replace into verified_images (
+  path,
+  size,
+  mtime,
+  status,
+  error
+) values (?, ?, ?, ?, ?)
+''', [path, size, mtime, status, error]
+
+
+def create_table_image_sizes():
+    return '''\
+create table if not exists image_sizes (
+  image_id text primary key,
+  image_type text,
+  width int,
+  height int
+);
+'''
+
+
+def replace_into_image_sizes():
+    return '''\
+insert or replace into image_sizes (
+  image_id,
+  image_type,
+  width,
+  height
+) values (?, ?, ?, ?)
+'''
+
+
+def parse_image_sizes(params, encoder=None):
+    return params
+
+
+def create_table_letterboxes():
+    return '''\
+create table if not exists letterboxes (
+  image_id text primary key,
+  image_type text,
+  x float,
+  y float,
+  width float,
+  height float
+);
+'''
+
+
+def replace_into_letterboxes():
+    return '''\
+insert or replace into letterboxes (
+  image_id,
+  image_type,
+  x,
+  y,
+  width,
+  height
+) values (?, ?, ?, ?, ?, ?)
+'''
+
+
+def parse_letterboxes(params, encoder=None):
+    return params
+
+
+def delete_from_letterboxes():
+    return '''\
+delete from letterboxes where image_id = ?
+'''
+
+
+def select_letterbox(image_id):
+    return '''\
+select x, y, width, height from letterboxes where image_id = ?
+''', [image_id]
+
+
+def create_table_image_cache():
+    return '''\
+create table if not exists image_cache (
+  image_id text primary key,
+  image_type text,
+  name text,
+  size int,
+  md5 text,
+  accessed_at float
+);
+create index if not exists image_cache_accessed_at on image_cache(accessed_at);
+'''
+
+
+def select_image_cache(image_id):
+    return '''\
+select image_type, name, size from image_cache where image_id = ?
+''', [image_id]
+
+
+def select_image_cache_size():
+    return '''\
+select coalesce(sum(size), 0) from image_cache
+'''
+
+
+def select_image_cache_lru(limit):
+    return '''\
+select image_id, name, size from image_cache order by accessed_at limit ?
+''', [limit]
+
+
+def replace_into_image_cache(image_id, image_type, name, size, md5, accessed_at):
+    return '''\
+insert or replace into image_cache (
+  image_id,
+  image_type,
+  name,
+  size,
+  md5,
+  accessed_at
+) values (?, ?, ?, ?, ?, ?)
+''', [image_id, image_type, name, size, md5, accessed_at]
+
+
+def update_image_cache_accessed_at(image_id, accessed_at):
+    return '''\
+update image_cache set accessed_at = ? where image_id = ?
+''', [accessed_at, image_id]
+
+
+def delete_from_image_cache(image_id):
+    return '''\
+delete from image_cache where image_id = ?
+''', [image_id]
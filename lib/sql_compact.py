@@ -0,0 +1,657 @@
+# Compact schema: image ids, label names and sources are stored as integer keys.
+# Builders not defined here are the same as in lib.sql.
+from lib.sql import *  # noqa: F401,F403
+from lib.sql import merge_into_table as merge_into_text_table
+
+IMAGE_KEY_SIGN = -2 ** 63
+
+
+def image_key(image_id):
+    # 16 hex digit image ids as signed 64-bit integers, preserving their order
+    return int(image_id, 16) + IMAGE_KEY_SIGN
+
+
+def image_id_of(column):
+    return f"printf('%016x', ({column} | {IMAGE_KEY_SIGN}) & ~({column} & {IMAGE_KEY_SIGN}))"
+
+
+def create_table_lookups():
+    return '''\
+create table if not exists label_names (
+  id integer primary key,
+  label_name text unique
+);
+create table if not exists sources (
+  id integer primary key,
+  source text unique
+);
+'''
+
+
+def insert_into_label_names():
+    return 'insert into label_names (id, label_name) values (?, ?)'
+
+
+def insert_into_sources():
+    return 'insert into sources (id, source) values (?, ?)'
+
+
+def select_label_names():
+    return 'select label_name, id from label_names'
+
+
+def select_sources():
+    return 'select source, id from sources'
+
+
+def merge_lookups():
+    return '''\
+insert or ignore into main.label_names (label_name) select label_name from shard.label_names order by id;
+insert or ignore into main.sources (source) select source from shard.sources order by id;
+'''
+
+
+def create_table_bboxes(table):
+    return f'''\
+create table if not exists {table} (
+  image int,
+  source int,
+  label int,
+  confidence float,
+  x_min float,
+  x_max float,
+  y_min float,
+  y_max float,
+  is_occluded int,
+  is_truncated int,
+  is_group_of int,
+  is_depiction int,
+  is_inside int
+);
+'''
+
+
+def create_index_bboxes(table):
+    return f'''\
+create index if not exists {table}_image_and_label on {table}(image, label);
+create index if not exists {table}_label on {table}(label);
+'''
+
+
+def insert_into_bboxes(table):
+    return f'''\
+insert into {table} (
+  image,
+  source,
+  label,
+  confidence,
+  x_min,
+  x_max,
+  y_min,
+  y_max,
+  is_occluded,
+  is_truncated,
+  is_group_of,
+  is_depiction,
+  is_inside
+) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def parse_bboxes(params, encoder=None):
+    return [
+        image_key(params[0]),
+        encoder.source(params[1]) if params[1] else None,
+        encoder.label(params[2]) if params[2] else None,
+        float(params[3]) if params[3] else None,
+        float(params[4]) if params[4] else None,
+        float(params[5]) if params[5] else None,
+        float(params[6]) if params[6] else None,
+        float(params[7]) if params[7] else None,
+        int(params[8]) if params[8] else None,
+        int(params[9]) if params[9] else None,
+        int(params[10]) if params[10] else None,
+        int(params[11]) if params[11] else None,
+        int(params[12]) if params[12] else None,
+    ]
+
+
+def create_table_labels(table):
+    return f'''\
+create table if not exists {table} (
+  image int,
+  source int,
+  label int,
+  confidence float
+);
+'''
+
+
+def create_index_labels(table):
+    return f'''\
+create index if not exists {table}_image_and_label on {table}(image, label);
+'''
+
+
+def insert_into_labels(table):
+    return f'''\
+insert into {table} (
+  image,
+  source,
+  label,
+  confidence
+) values (?, ?, ?, ?)
+'''
+
+
+def parse_labels(params, encoder=None):
+    return [
+        image_key(params[0]),
+        encoder.source(params[1]) if params[1] else None,
+        encoder.label(params[2]) if params[2] else None,
+        float(params[3]) if params[3] else None,
+    ]
+
+
+def create_table_images(table):
+    return f'''\
+create table if not exists {table} (
+  image integer primary key,
+  subset text,
+  original_url text,
+  original_landing_url text,
+  license text,
+  author_profile_url text,
+  author text,
+  title text,
+  original_size int,
+  original_md5 text,
+  thumbnail_300k_url text,
+  rotation float
+);
+'''
+
+
+def create_index_images(table):
+    return ''
+
+
+def insert_into_images(table):
+    return f'''\
+insert into {table} (
+  image,
+  subset,
+  original_url,
+  original_landing_url,
+  license,
+  author_profile_url,
+  author,
+  title,
+  original_size,
+  original_md5,
+  thumbnail_300k_url,
+  rotation
+) values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def parse_images(params, encoder=None):
+    return [
+        image_key(params[0]),
+        params[1] if params[1] else None,
+        params[2] if params[2] else None,
+        params[3] if params[3] else None,
+        params[4] if params[4] else None,
+        params[5] if params[5] else None,
+        params[6] if params[6] else None,
+        params[7] if params[7] else None,
+        int(params[8]) if params[8] else None,
+        params[9] if params[9] else None,
+        params[10] if params[10] else None,
+        float(params[11]) if params[11] != '' else None,
+    ]
+
+
+def merge_into_table(kind, table):
+    if kind not in ('bboxes', 'labels'):
+        return merge_into_text_table(kind, table)
+
+    # Shard lookup keys are remapped to the keys of the main DB
+    columns = 'confidence, x_min, x_max, y_min, y_max, is_occluded, is_truncated, is_group_of, is_depiction, is_inside' \
+        if kind == 'bboxes' else 'confidence'
+    return f'''\
+insert into main.{table}
+select
+  t.image,
+  main_sources.id,
+  main_label_names.id,
+  {', '.join(f't.{column}' for column in columns.split(', '))}
+from
+  shard.{table} as t
+  left join shard.sources as shard_sources
+    on t.source = shard_sources.id
+  left join main.sources as main_sources
+    on shard_sources.source = main_sources.source
+  left join shard.label_names as shard_label_names
+    on t.label = shard_label_names.id
+  left join main.label_names as main_label_names
+    on shard_label_names.label_name = main_label_names.label_name
+'''
+
+
+def create_table_annotations(table, bboxes_table, labels_table, images_table):
+    return f'''\
+drop table if exists {table};
+create table {table} as
+select
+  {image_id_of('bboxes.image')} as image_id,
+  label_names.label_name,
+  classes.class_name,
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max,
+  images.original_url,
+  images.thumbnail_300k_url,
+  images.rotation,
+  images.original_size,
+  images.original_md5
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image = labels.image and bboxes.label = labels.label
+  join {images_table} as images
+    on bboxes.image = images.image
+  join label_names
+    on labels.label = label_names.id
+  join classes
+    on label_names.label_name = classes.label_name
+where
+  bboxes.is_group_of = 0
+  and labels.confidence = 1
+order by
+  bboxes.image
+;
+create index if not exists {table}_image_id on {table}(image_id);
+create index if not exists {table}_class_name_and_image_id on {table}(class_name, image_id);
+'''
+
+
+def create_temp_table_class_boxes(bboxes_table, labels_table):
+    return f'''\
+drop table if exists temp.class_boxes;
+create temp table class_boxes as
+select
+  bboxes.image as image,
+  classes.rowid as class_id,
+  (bboxes.x_max - bboxes.x_min) * (bboxes.y_max - bboxes.y_min) as area
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image = labels.image and bboxes.label = labels.label
+  join label_names
+    on labels.label = label_names.id
+  join classes
+    on label_names.label_name = classes.label_name
+where
+  bboxes.is_group_of = 0
+  and labels.confidence = 1
+;
+'''
+
+
+def select_columnar_bboxes(bboxes_table, labels_table):
+    return f'''\
+select
+  {image_id_of('bboxes.image')},
+  label_names.label_name,
+  bboxes.confidence,
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max,
+  bboxes.is_occluded,
+  bboxes.is_truncated,
+  bboxes.is_group_of,
+  bboxes.is_depiction,
+  bboxes.is_inside,
+  exists (
+    select 1 from {labels_table} as labels
+    where labels.image = bboxes.image and labels.label = bboxes.label and labels.confidence = 1
+  ) as verified
+from
+  {bboxes_table} as bboxes
+  left join label_names
+    on bboxes.label = label_names.id
+order by
+  bboxes.image
+;
+'''
+
+
+def select_class_box_counts(bboxes_table, labels_table):
+    return f'''\
+select
+  label_names.label_name,
+  count(*)
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image = labels.image and bboxes.label = labels.label
+  join label_names
+    on bboxes.label = label_names.id
+where
+  bboxes.is_group_of = 0
+  and labels.confidence = 1
+group by
+  bboxes.label
+;
+'''
+
+
+def select_images(
+    bboxes_table,
+    labels_table,
+    images_table,
+    image_id=None,
+    class_names=None,
+    limit=None,
+    offset=0,
+    annotations_table=None,
+    after_image_id=None,
+    shard=None
+):
+    if annotations_table:
+        return select_images_from_annotations(  # noqa: F405
+            annotations_table,
+            image_id=image_id,
+            class_names=class_names,
+            limit=limit,
+            offset=offset,
+            after_image_id=after_image_id,
+            shard=shard,
+        )
+
+    params = []
+
+    where_clause = 'where bboxes.is_group_of = 0 and labels.confidence = 1'
+    if image_id:
+        where_clause += ' and bboxes.image = ?'
+        params.append(image_key(image_id))
+    if after_image_id:
+        where_clause += ' and bboxes.image > ?'
+        params.append(image_key(after_image_id))
+    if shard:
+        where_clause += f" and image_shard({image_id_of('bboxes.image')}, ?) = ?"
+        params += [shard[1], shard[0]]
+    if class_names:
+        where_clause += f" and classes.class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+
+    limit_clause = f'limit {limit} offset {offset}' if limit else ''
+
+    # URLs and rotation depend only on the image, so grouping streams in index order without distinct
+    return f'''\
+select
+  {image_id_of('bboxes.image')},
+  images.original_url,
+  images.thumbnail_300k_url,
+  images.rotation,
+  images.original_size,
+  images.original_md5
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image = labels.image and bboxes.label = labels.label
+  join {images_table} as images
+    on bboxes.image = images.image
+  join label_names
+    on labels.label = label_names.id
+  join classes
+    on label_names.label_name = classes.label_name
+{where_clause}
+group by
+  bboxes.image
+order by
+  bboxes.image
+{limit_clause}
+;
+''', params
+
+
+def select_image(images_table, image_id):
+    return f'''\
+select {image_id_of('image')}, original_url, thumbnail_300k_url, rotation, original_size, original_md5
+from {images_table} where image = ?
+''', [image_key(image_id)]
+
+
+def select_labels(
+    bboxes_table,
+    labels_table,
+    image_id,
+    class_names=None,
+    confidence=1,
+    annotations_table=None
+):
+    if annotations_table:
+        return select_labels_from_annotations(  # noqa: F405
+            annotations_table,
+            image_id=image_id,
+            class_names=class_names,
+        )
+
+    if class_names:
+        class_names_cond = f"and classes.class_name in ({','.join(['?'] * len(class_names))})"
+    else:
+        class_names_cond = ''
+
+    return f'''\
+select
+  classes.class_name,
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image = labels.image and bboxes.label = labels.label
+  join label_names
+    on labels.label = label_names.id
+  join classes
+    on label_names.label_name = classes.label_name
+where
+  bboxes.image = ?
+  {class_names_cond}
+  and labels.confidence >= ?
+  and bboxes.is_group_of = 0
+;
+''', [image_key(image_id), *(class_names if class_names else []), confidence]
+
+
+def select_labels_by_image(
+    bboxes_table,
+    labels_table,
+    class_names=None,
+    confidence=1,
+    from_image_id=None,
+    annotations_table=None
+):
+    if annotations_table:
+        return select_labels_from_annotations(  # noqa: F405
+            annotations_table,
+            class_names=class_names,
+            from_image_id=from_image_id,
+            with_image_id=True,
+        )
+
+    params = []
+
+    where_clause = 'where labels.confidence >= ? and bboxes.is_group_of = 0'
+    params.append(confidence)
+    if class_names:
+        where_clause += f" and classes.class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+    if from_image_id:
+        where_clause += ' and bboxes.image >= ?'
+        params.append(image_key(from_image_id))
+
+    return f'''\
+select
+  {image_id_of('bboxes.image')},
+  classes.class_name,
+  bboxes.x_min,
+  bboxes.y_min,
+  bboxes.x_max,
+  bboxes.y_max
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image = labels.image and bboxes.label = labels.label
+  join label_names
+    on labels.label = label_names.id
+  join classes
+    on label_names.label_name = classes.label_name
+{where_clause}
+order by
+  bboxes.image
+;
+''', params
+
+
+def select_class_image_labels(
+    bboxes_table,
+    labels_table,
+    class_name,
+    class_names=None,
+    min_box_size=0,
+    annotations_table=None
+):
+    if annotations_table:
+        return select_class_image_labels_from_annotations(  # noqa: F405
+            annotations_table,
+            class_name,
+            class_names=class_names,
+            min_box_size=min_box_size,
+        )
+
+    # The boxes of class_name select the images, and the boxes of class_names in them are returned
+    box_filter = 'bboxes.is_group_of = 0 and +labels.confidence = 1'
+    params = [class_name]
+    if min_box_size:
+        box_filter += ' and (bboxes.x_max - bboxes.x_min) * (bboxes.y_max - bboxes.y_min) >= ?'
+        params.append(min_box_size ** 2)
+    where_clause = f'where bboxes.image in (select image from images) and {box_filter}'
+    params += params[1:]
+    if class_names:
+        where_clause += f" and classes.class_name in ({','.join(['?'] * len(class_names))})"
+        params += class_names
+
+    return f'''\
+with images as (
+  select
+    bboxes.image
+  from
+    {bboxes_table} as bboxes
+    join {labels_table} as labels
+      on bboxes.image = labels.image and bboxes.label = labels.label
+    join label_names
+      on labels.label = label_names.id
+    join classes
+      on label_names.label_name = classes.label_name
+  where
+    classes.class_name = ?
+    and {box_filter}
+)
+select
+  {image_id_of('bboxes.image')},
+  classes.class_name
+from
+  {bboxes_table} as bboxes
+  join {labels_table} as labels
+    on bboxes.image = labels.image and bboxes.label = labels.label
+  join label_names
+    on labels.label = label_names.id
+  join classes
+    on label_names.label_name = classes.label_name
+{where_clause}
+order by
+  bboxes.image
+;
+''', params
+
+
+def select_image_md5s(images_table, image_ids):
+    return f'''\
+select {image_id_of('image')}, original_size, original_md5 from {images_table}
+where image in ({','.join(['?'] * len(image_ids))})
+''', [image_key(image_id) for image_id in image_ids]
+
+
+def create_table_image_sizes():
+    return '''\
+create table if not exists image_sizes (
+  image integer primary key,
+  image_type text,
+  width int,
+  height int
+);
+'''
+
+
+def replace_into_image_sizes():
+    return '''\
+insert or replace into image_sizes (
+  image,
+  image_type,
+  width,
+  height
+) values (?, ?, ?, ?)
+'''
+
+
+def parse_image_sizes(params, encoder=None):
+    return [image_key(params[0]), *params[1:]]
+
+
+def create_table_letterboxes():
+    return '''\
+create table if not exists letterboxes (
+  image integer primary key,
+  image_type text,
+  x float,
+  y float,
+  width float,
+  height float
+);
+'''
+
+
+def replace_into_letterboxes():
+    return '''\
+insert or replace into letterboxes (
+  image,
+  image_type,
+  x,
+  y,
+  width,
+  height
+) values (?, ?, ?, ?, ?, ?)
+'''
+
+
+def parse_letterboxes(params, encoder=None):
+    return [image_key(params[0]), *params[1:]]
+
+
+def delete_from_letterboxes():
+    return '''\
+delete from letterboxes where image = ?
+'''
+
+
+def select_letterbox(image_id):
+    return '''\
+select x, y, width, height from letterboxes where image = ?
+''', [image_key(image_id)]
@@ -0,0 +1,189 @@
+import base64
+import functools
+import os
+import re
+import sqlite3
+import struct
+
+import cv2
+
+from lib import sql, md5sum
+
+JPEG_SOI = b'\xff\xd8\xff'
+JPEG_EOI = b'\xff\xd9'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_IEND = b'IEND\xaeB`\x82'
+# Start of frame markers, except DHT, JPG and DAC which share the range
+JPEG_SOF_MARKERS = frozenset(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+JPEG_STANDALONE_MARKERS = frozenset([0x01, *range(0xd0, 0xd8)])
+# Markers between segments and in entropy-coded data, without stuffed 0xff00, restarts and fill bytes
+JPEG_MARKER = re.compile(rb'\xff[^\x00\xd0-\xd7\xff]')
+PROBE_CACHE_SIZE = 65536
+
+
+def find_jpeg_eoi(data):
+    """Returns the offset of the end of image marker of the primary image, walking its segments and scans."""
+    pos = len(JPEG_SOI) - 1
+    while True:
+        match = JPEG_MARKER.search(data, pos)
+        if not match:
+            return None
+        code = data[match.start() + 1]
+        if code == 0xd9:
+            return match.start()
+        pos = match.end()
+        if code in JPEG_STANDALONE_MARKERS:
+            continue
+        if pos + 2 > len(data):
+            return None
+        # Segments (e.g. EXIF thumbnails with their own end of image) are skipped by length
+        pos += struct.unpack('>H', data[pos:pos + 2])[0]
+
+
+def find_png_iend(data):
+    """Returns the offset of the IEND chunk, walking the chunks by length."""
+    pos = len(PNG_SIGNATURE)
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        if chunk_type == PNG_IEND[:4]:
+            return pos
+        pos += length + 12
+    return None
+
+
+def check_markers(path, tail_size=1024):
+    """Returns an error message when the JPEG/PNG start and end markers are missing, None otherwise."""
+    with open(path, 'rb') as f:
+        head = f.read(len(PNG_SIGNATURE))
+        f.seek(0, os.SEEK_END)
+        f.seek(max(f.tell() - tail_size, 0))
+        tail = f.read()
+
+        # Padding, camera trailers (e.g. motion photos) and appended metadata may follow the end marker. Entropy-coded
+        # data never holds it, as 0xff is stuffed with 0x00, so the tail settles most images. Otherwise the segments
+        # are walked up to the end marker, as a truncated image still decodes, with gray rows
+        if head.startswith(JPEG_SOI):
+            if JPEG_EOI not in tail:
+                f.seek(0)
+                if find_jpeg_eoi(f.read()) is None:
+                    return 'JPEG end of image marker not found'
+        elif head == PNG_SIGNATURE:
+            if PNG_IEND not in tail:
+                f.seek(0)
+                if find_png_iend(f.read()) is None:
+                    return 'PNG IEND chunk not found'
+        else:
+            return 'Unknown image signature'
+    return None
+
+
+def read_jpeg_size(f):
+    # Walks the marker segments after SOI up to the first start of frame
+    f.seek(len(JPEG_SOI) - 1)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xff:
+            return None
+        while marker[1] == 0xff:
+            # Fill bytes before the marker code
+            code = f.read(1)
+            if not code:
+                return None
+            marker = b'\xff' + code
+        if marker[1] in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker[1] in (0xd9, 0xda):
+            # End of image or start of scan before a frame header
+            return None
+
+        length = f.read(2)
+        if len(length) < 2:
+            return None
+        if marker[1] in JPEG_SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            return width, height
+        f.seek(struct.unpack('>H', length)[0] - 2, os.SEEK_CUR)
+
+
+def read_png_size(f):
+    # IHDR is the first chunk: length, type, width and height
+    f.seek(len(PNG_SIGNATURE))
+    chunk = f.read(16)
+    if len(chunk) < 16 or chunk[4:8] != b'IHDR':
+        return None
+    return struct.unpack('>II', chunk[8:16])
+
+
+def probe_image(path):
+    """Returns (width, height, error) read from the JPEG/PNG header without decoding the image.
+
+    error is None when the header holds the size and the end marker is present, which catches truncated
+    downloads. Results are cached per path, size and mtime.
+    """
+    stat = os.stat(path)
+    return _probe_image(path, stat.st_size, stat.st_mtime_ns)
+
+
+@functools.lru_cache(maxsize=PROBE_CACHE_SIZE)
+def _probe_image(path, size, mtime_ns):
+    error = check_markers(path)
+    if error:
+        return None, None, error
+
+    with open(path, 'rb') as f:
+        read_size = read_png_size if f.read(len(PNG_SIGNATURE)) == PNG_SIGNATURE else read_jpeg_size
+        image_size = read_size(f)
+    if not image_size or 0 in image_size:
+        return None, None, 'Image size not found in header'
+    return (*image_size, None)
+
+
+def verify_image(task):
+    path, expected_size, expected_md5, decode = task
+
+    try:
+        stat = os.stat(path)
+    except OSError as e:
+        return path, None, None, 'missing', str(e)
+
+    result = path, stat.st_size, stat.st_mtime
+    if stat.st_size == 0:
+        return (*result, 'corrupt', 'Empty file')
+
+    error = probe_image(path)[2]
+    if error:
+        return (*result, 'corrupt', error)
+
+    # original_md5 applies only to the original image, not to thumbnails
+    if expected_md5 and stat.st_size == expected_size:
+        if md5sum(path) != base64.b64decode(expected_md5).hex():
+            return (*result, 'md5_mismatch', f'Expected MD5 {expected_md5}')
+
+    if decode and cv2.imread(path) is None:
+        return (*result, 'corrupt', 'Decode failed')
+
+    return (*result, 'ok', None)
+
+
+class VerifyCache:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('pragma journal_mode = WAL')
+        self.conn.execute('pragma synchronous = NORMAL')
+        self.conn.executescript(sql.create_table_verified_images())
+
+    def get(self, path, size, mtime):
+        return self.conn.execute(*sql.select_verified_image(path, size, mtime)).fetchone()
+
+    def set(self, path, size, mtime, status, error):
+        self.conn.execute(*sql.replace_into_verified_images(path, size, mtime, status, error))
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
@@ -3,112 +3,270 @@
 import argparse
 import os
 import sqlite3
-import tempfile
-from contextlib import closing
+from contextlib import closing, ExitStack
+from functools import partial
 
 import cv2
-import requests
 
-from lib import logging, sql, rotate_bbox, is_url_available
-from settings import DATASET, DATASET_DB, BBOX_COLORS
+from lib import (
+    image_cache,
+    logging,
+    sql_schema,
+    make_image_name,
+    is_url_available,
+    table_exists,
+    letterbox_finder,
+)
+from lib.bbox import to_pixels
+from lib.classes import load_classes
+from lib.labels import iter_yolo_boxes
+from lib.http import make_session, AvailabilityCache
+from lib.image import read_image, decode_image, write_image, crop_content
+from lib.pipeline import Stage, Pipeline
+from lib.preview import draw_boxes, make_tile, make_mosaic
+from lib.verify import probe_image
+from settings import (
+    DATASET,
+    DATASET_DB,
+    ANNOTATIONS,
+    BBOX_COLORS,
+    IMAGES_DIR,
+    IMAGE_CACHE_DIR,
+    IMAGE_CACHE_SIZE,
+    URL_CACHE_DB,
+    URL_CACHE_TTL,
+    HTTP_TIMEOUT,
+)
 
 
-def main(args):
-    logger = logging.getLogger(__name__)
-    logger.setLevel(args.loglevel)
+def load_image(row, images_dir, cache, session, url_cache, find_letterbox, logger, max_side=None):
+    """Returns the decoded image and its type, from the image cache or images_dir before the network."""
+    image_id, org_url, thumb_url, rotation, original_size, original_md5 = row
+
+    # The cache keeps the originals, while local copies may have been resized by download_images.py
+    if cache is not None:
+        image_path, image_type = cache.get(image_id)
+        if image_path:
+            width, height, error = probe_image(image_path)
+            if not error:
+                return read_image(image_path, max_side, (width, height)), image_type
+
+    for image_url, image_type in ((thumb_url, 'thumb'), (org_url, 'org')):
+        if image_url:
+            image_path = os.path.join(images_dir, make_image_name(image_id, image_url))
+            if os.path.exists(image_path):
+                width, height, error = probe_image(image_path)
+                if not error:
+                    img_bgr = read_image(image_path, max_side, (width, height))
+                    # The padding of images letterboxed by download_images.py would misalign the boxes
+                    content = find_letterbox(image_id)
+                    if img_bgr is not None and content:
+                        img_bgr = crop_content(img_bgr, content)
+                    return img_bgr, image_type
+
+    for image_url, image_type in ((thumb_url, 'thumb'), (org_url, 'org')):
+        if not is_url_available(image_url, session, url_cache):
+            continue
+        response = session.get(image_url)
+        if response.status_code != 200:
+            continue
+        if cache is not None:
+            try:
+                cache.put(
+                    image_id,
+                    image_type,
+                    make_image_name(image_id, image_url),
+                    response.content,
+                    original_size,
+                    original_md5,
+                )
+            except ValueError as e:
+                logger.warn(f'[{image_id}:{image_type}] Not cached: {e}')
+        return decode_image(response.content, max_side), image_type
+
+    return None, None
 
-    image_id = args.image_id
 
-    with closing(sqlite3.connect(DATASET_DB)) as conn:
-        cur = conn.cursor()
+def draw_labels(img_bgr, labels, boxes, classes):
+    img_height, img_width, _ = img_bgr.shape
+    label_names = [label[0] for label in labels]
+    draw_boxes(
+        img_bgr,
+        label_names,
+        to_pixels(boxes, img_width, img_height),
+        [classes[class_name] for class_name in label_names],
+        BBOX_COLORS,
+    )
+
+
+def iter_images(conn, schema, image_ids, classes, annotations_table, args, logger):
+    labeled = iter_image_labels(conn, schema, image_ids, classes, annotations_table, args, logger)
+    # Boxes are converted a chunk of images at a time
+    for (row, labels), boxes in iter_yolo_boxes(((row, labels), labels, row[3]) for row, labels in labeled):
+        yield row, labels, boxes
 
-        query, params = sql.select_images(
+
+def iter_image_labels(conn, schema, image_ids, classes, annotations_table, args, logger):
+    if image_ids:
+        # Looked up by primary key in the images table instead of joining the bboxes
+        images_table = DATASET['images'][args.set]['table']
+        rows = (
+            (image_id, conn.execute(*schema.select_image(images_table, image_id)).fetchone())
+            for image_id in image_ids
+        )
+    else:
+        query, params = schema.select_images(
             bboxes_table=DATASET['bboxes'][args.set]['table'],
             labels_table=DATASET['labels'][args.set]['table'],
             images_table=DATASET['images'][args.set]['table'],
-            image_id=image_id,
+            class_names=classes.class_names,
+            limit=args.limit,
+            annotations_table=annotations_table,
         )
-        cur.execute(query, params)
-        row = cur.fetchone()
+        rows = ((row[0], row) for row in conn.execute(query, params))
+
+    for image_id, row in rows:
         if not row:
             logger.warn(f'[{args.set}:{image_id}] Image not found')
-            return
+            continue
 
-        _, org_url, thumb_url, rotation = row
-
-        query, params = sql.select_labels(
+        query, params = schema.select_labels(
             bboxes_table=DATASET['bboxes'][args.set]['table'],
             labels_table=DATASET['labels'][args.set]['table'],
-            image_id=image_id,
-            class_names=args.classes,
+            image_id=row[0],
+            class_names=classes.class_names if args.classes else None,
+            annotations_table=annotations_table,
         )
-        cur.execute(query, params)
-        labels = cur.fetchall()
-
-    if is_url_available(thumb_url):
-        image_url = thumb_url
-        image_type = 'thumb'
-    elif is_url_available(org_url):
-        image_url = org_url
-        image_type = 'org'
-    else:
-        logger.warn(f'[{args.set}:{image_id}] Image unavailable')
-        return
+        yield row, conn.execute(query, params).fetchall()
 
-    logger.info(f'[{args.set}:{image_id}:{image_type}] Downloading image {image_url}')
 
-    response = requests.get(image_url)
-    with tempfile.NamedTemporaryFile(delete=False) as f:
-        f.write(response.content)
-        img_path = f.name
+def render_tile(item, load, classes, args, logger):
+    seq, (row, labels, boxes) = item
+    # Failures are passed on as empty tiles, the pages wait for every seq
+    try:
+        img_bgr, image_type = load(row, max_side=args.tile_size)
+        if img_bgr is None:
+            logger.warn(f'[{args.set}:{row[0]}] Image unavailable')
+            return seq, None
 
-    img_bgr = cv2.imread(img_path)
-    if img_bgr is None:
-        logger.warn(f'[{args.set}:{image_id}] Invalid image')
-        os.remove(img_path)
-        return
+        logger.debug('[%s:%s:%s] Drawing tile', args.set, row[0], image_type)
+        draw_labels(img_bgr, labels, boxes, classes)
+        return seq, make_tile(img_bgr, args.tile_size, row[0])
+    except Exception as e:
+        logger.warn(f'[{args.set}:{row[0]}] Failed to render tile: {e!r}')
+        return seq, None
 
-    img_height, img_width, _ = img_bgr.shape
 
-    os.remove(img_path)
-
-    logger.info(f'[{args.set}:{image_id}:{image_type}] Drawing preview')
-
-    classes = args.classes if args.classes else list(set([r[0] for r in labels]))
-    for class_name, x, y, width, height in labels:
-        logger.debug(f'[{args.set}:{image_id}:{image_type}] {x} {y} {width} {height} {rotation}')
-        x, y, width, height = rotate_bbox(x, y, width, height, rotation)
-
-        left = int((x - width / 2) * img_width)
-        right = int((x + width / 2) * img_width)
-        top = int((y - height / 2) * img_height)
-        bottom = int((y + height / 2) * img_height)
-        color = BBOX_COLORS[classes.index(class_name) % len(BBOX_COLORS)]
-
-        cv2.rectangle(img_bgr, (left, top), (right, bottom), color, 1)
-        cv2.putText(
-            img_bgr,
-            class_name,
-            (left, top + 12),
-            cv2.FONT_HERSHEY_SIMPLEX,
-            .5,
-            color,
-            lineType=cv2.LINE_AA
-        )
+def preview_mosaic(images, load, classes, args, logger):
+    os.makedirs(args.mosaic, exist_ok=True)
+    pipeline = Pipeline([Stage(
+        'render',
+        partial(render_tile, load=load, classes=classes, args=args, logger=logger),
+        args.concurrency,
+    )])
+
+    def write_page(tiles, page):
+        mosaic_path = os.path.join(args.mosaic, f'{args.set}-{page:04d}.png')
+        write_image(mosaic_path, make_mosaic(tiles, args.columns))
+        logger.info(f'[{args.set}] Wrote {len(tiles)} images -> {mosaic_path}')
+
+    # Tiles finish out of order, pages keep the order of the images
+    done = {}
+    next_seq = 0
+    tiles = []
+    page = 0
+    for seq, tile in pipeline.run(enumerate(images)):
+        done[seq] = tile
+        while next_seq in done:
+            tile = done.pop(next_seq)
+            next_seq += 1
+            if tile is None:
+                continue
+            tiles.append(tile)
+            if len(tiles) == args.columns * args.rows:
+                write_page(tiles, page)
+                tiles = []
+                page += 1
+    if tiles:
+        write_page(tiles, page)
+
+
+def preview_single(images, load, classes, args, logger):
+    for row, labels, boxes in images:
+        image_id, _, _, rotation, _, _ = row
+        img_bgr, image_type = load(row)
+        if img_bgr is None:
+            logger.warn(f'[{args.set}:{image_id}] Image unavailable or invalid')
+            return
+
+        logger.info(f'[{args.set}:{image_id}:{image_type}] Drawing preview')
+        draw_labels(img_bgr, labels, boxes, classes)
+        logger.debug('[%s:%s:%s] %s %s', args.set, image_id, image_type, boxes, rotation)
+
+        logger.info(f'[{args.set}:{image_id}:{image_type}] Displaying preview')
 
-    logger.info(f'[{args.set}:{image_id}:{image_type}] Displaying preview')
+        cv2.imshow('preview', img_bgr)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
 
-    cv2.imshow('preview', img_bgr)
-    cv2.waitKey(0)
-    cv2.destroyAllWindows()
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
+
+    image_ids = list(args.image_ids)
+    if args.ids_file:
+        with open(args.ids_file, 'r') as f:
+            image_ids += [line.strip() for line in f if line.strip()]
+
+    # The DB cursors are iterated by the pipeline feeder thread in mosaic mode
+    with ExitStack() as stack:
+        conn = stack.enter_context(closing(sqlite3.connect(DATASET_DB, check_same_thread=False)))
+        url_cache = stack.enter_context(closing(AvailabilityCache(URL_CACHE_DB, URL_CACHE_TTL)))
+        cache = image_cache.from_args(args, IMAGE_CACHE_DIR, IMAGE_CACHE_SIZE)
+        if cache is not None:
+            stack.callback(cache.close)
+        schema = sql_schema(conn)
+
+        try:
+            classes = load_classes(conn, args.classes)
+        except ValueError as e:
+            logger.error(e)
+            return
+
+        annotations_table = ANNOTATIONS[args.set]['table']
+        if not table_exists(conn, annotations_table):
+            annotations_table = None
+
+        images = iter_images(conn, schema, image_ids, classes, annotations_table, args, logger)
+        load = partial(
+            load_image,
+            images_dir=os.path.join(IMAGES_DIR, args.set),
+            cache=cache,
+            session=make_session(pool_size=args.concurrency, timeout=HTTP_TIMEOUT),
+            url_cache=url_cache,
+            find_letterbox=letterbox_finder(conn),
+            logger=logger,
+        )
+        if args.mosaic:
+            preview_mosaic(images, load, classes, args, logger)
+        else:
+            preview_single(images, load, classes, args, logger)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
-        'image_id',
+        'image_ids',
+        type=str,
+        nargs='*',
+        metavar='image_id',
+    )
+    parser.add_argument(
+        '--ids-file',
         type=str,
+        help='File with one image_id per line',
     )
     parser.add_argument(
         '--set',
@@ -121,8 +279,45 @@ if __name__ == '__main__':
         '--classes',
         type=str,
         nargs='+',
-        help='List of classes to download (e.g. Person "Human eye")',
+        help='List of classes to preview (e.g. Person "Human eye"), and of images without image ids',
+    )
+    parser.add_argument(
+        '--mosaic',
+        type=str,
+        metavar='DIR',
+        help='Write annotated tiles to paginated mosaic PNGs in DIR instead of displaying the image',
+    )
+    parser.add_argument(
+        '--limit',
+        type=int,
+        default=100,
+        help='Number of images of --classes in mosaics',
+    )
+    parser.add_argument(
+        '--tile-size',
+        type=int,
+        default=256,
+        help='Size in pixels of the square mosaic tiles',
+    )
+    parser.add_argument(
+        '--columns',
+        type=int,
+        default=8,
+        help='Number of tiles per mosaic row',
+    )
+    parser.add_argument(
+        '--rows',
+        type=int,
+        default=6,
+        help='Number of tile rows per mosaic page',
+    )
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=8,
+        help='Number of images fetched and drawn concurrently',
     )
+    image_cache.add_arguments(parser)
     parser.add_argument(
         '-l', '--loglevel',
         type=str.upper,
@@ -130,4 +325,9 @@ if __name__ == '__main__':
         default='INFO',
     )
 
-    main(parser.parse_args())
+    args = parser.parse_args()
+    if not args.image_ids and not args.ids_file and not args.classes:
+        parser.error('image_id, --ids-file or --classes is required')
+    if not args.mosaic and (len(args.image_ids) != 1 or args.ids_file):
+        parser.error('--mosaic is required to preview more than one image')
+    main(args)
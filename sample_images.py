@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sqlite3
+import sys
+from collections import Counter, defaultdict
+from contextlib import closing, ExitStack
+from itertools import groupby
+from operator import itemgetter
+
+from lib import logging, sql, sql_schema, table_exists
+from lib.classes import load_classes
+from lib.columnar import ColumnarStore
+from settings import DATASET, DATASET_DB, ANNOTATIONS, CLASS_STATS, COLUMNAR_DIR
+
+
+def class_availability(class_stats, class_box_sizes, min_box_size):
+    """Returns an upper bound of the images of each class with a box of at least min_box_size.
+
+    A class has no more such images than it has images, nor than it has boxes in the size buckets from the one of
+    min_box_size up.
+    """
+    min_bucket = min(int(min_box_size * sql.BOX_SIZE_BUCKETS), sql.BOX_SIZE_BUCKETS - 1)
+    boxes = Counter()
+    for class_name, size_bucket, count in class_box_sizes:
+        if size_bucket >= min_bucket:
+            boxes[class_name] += count
+    return {class_name: min(images, boxes[class_name]) for class_name, _, images in class_stats}
+
+
+def class_order(class_stats, class_pairs, available, per_class):
+    """Orders classes rarest first, except those that the picks of rarer classes are expected to fill.
+
+    Picking an image of class a is expected to add pairs(a, b) / images(a) images to each co-occurring class b.
+    Classes expected to reach per_class that way come last, and are only sampled for what they still lack.
+    """
+    images = {class_name: images for class_name, _, images in class_stats}
+    pairs = defaultdict(list)
+    for class_name, other_class_name, shared in class_pairs:
+        pairs[class_name].append((other_class_name, shared))
+        pairs[other_class_name].append((class_name, shared))
+
+    expected = Counter()
+    order = []
+    filled = []
+    for class_name in sorted(available, key=lambda class_name: (available[class_name], class_name)):
+        picks = min(per_class, available[class_name]) - expected[class_name]
+        if picks <= 0:
+            filled.append(class_name)
+            continue
+        order.append(class_name)
+        for other_class_name, shared in pairs[class_name]:
+            expected[other_class_name] += picks * shared / images[class_name]
+    return order + filled
+
+
+def class_candidates(conn, schema, classes, annotations_table, args):
+    """Returns a function streaming the images of a class, with the classes of each image, ordered by image_id."""
+    def candidates(class_name):
+        query, params = schema.select_class_image_labels(
+            bboxes_table=DATASET['bboxes'][args.set]['table'],
+            labels_table=DATASET['labels'][args.set]['table'],
+            class_name=class_name,
+            class_names=classes.class_names,
+            min_box_size=args.min_box_size,
+            annotations_table=annotations_table,
+        )
+        for image_id, rows in groupby(conn.execute(query, params), key=itemgetter(0)):
+            yield image_id, {row[1] for row in rows}
+    return candidates
+
+
+def columnar_candidates(store, classes, args):
+    """Returns a function streaming the images of a class from the columnar store, like class_candidates."""
+    mask = store.positive_mask()
+    if args.min_box_size:
+        mask &= store.box_areas() >= args.min_box_size ** 2
+    label_images = store.label_images(mask)
+
+    class_names = {}
+    for label_name, class_name in zip(classes.label_names, classes.class_names):
+        label_id = store.label_id(label_name)
+        if label_id is not None:
+            class_names[label_id] = class_name
+    label_ids = {class_name: label_id for label_id, class_name in class_names.items()}
+
+    def candidates(class_name):
+        if class_name not in label_ids:
+            return
+        for i in label_images[label_ids[class_name]]:
+            labels = store.image_labels(i, mask)
+            yield store.image_ids[i].decode(), {class_names[label] for label in labels.tolist() if label in class_names}
+    return candidates
+
+
+def sample_images(candidates, order, available, args, logger):
+    """Picks up to per_class images of each class in order, skipping images of classes at the cap.
+
+    Every class of a picked image counts towards its total, so dominant classes that co-occur with rare ones
+    fill up without being sampled for themselves. The images of a class are only read while it is short.
+    """
+    counts = Counter()
+    picked = set()
+    for class_name in order:
+        quota = min(args.per_class, available[class_name])
+        if counts[class_name] >= quota:
+            logger.debug('[%s:%s] %d images from other classes', args.set, class_name, counts[class_name])
+            continue
+
+        for image_id, image_classes in candidates(class_name):
+            if image_id in picked:
+                continue
+            if args.cap and any(counts[name] >= args.cap for name in image_classes):
+                continue
+            picked.add(image_id)
+            counts.update(image_classes)
+            if counts[class_name] >= args.per_class:
+                break
+
+        logger.debug('[%s:%s] %d of %d images', args.set, class_name, counts[class_name], available[class_name])
+        if counts[class_name] < quota:
+            logger.info(f'[{args.set}:{class_name}] Only {counts[class_name]} of {quota} images under the cap')
+
+    return sorted(picked), counts
+
+
+def main(args):
+    logger = logging.getLogger(__name__)
+    logger.setLevel(args.loglevel)
+
+    with closing(sqlite3.connect(DATASET_DB)) as conn:
+        schema = sql_schema(conn)
+
+        try:
+            classes = load_classes(conn, args.classes)
+        except ValueError as e:
+            logger.error(e)
+            return
+
+        tables = CLASS_STATS[args.set]
+        missing = [table for table in tables.values() if not table_exists(conn, table)]
+        if missing:
+            logger.error(f"{', '.join(missing)} not found, run ./import_dataset.py without --without-stats")
+            return
+        class_stats = conn.execute(*sql.select_class_stats(tables['classes'], classes.class_names)).fetchall()
+        class_names = set(classes.class_names)
+        class_pairs = [
+            row for row in conn.execute(sql.select_class_pairs(tables['pairs']))
+            if row[0] in class_names and row[1] in class_names
+        ]
+        class_box_sizes = [
+            row for row in conn.execute(sql.select_class_box_sizes(tables['box_sizes']))
+            if row[0] in class_names
+        ]
+
+        available = class_availability(class_stats, class_box_sizes, args.min_box_size)
+        order = class_order(class_stats, class_pairs, available, args.per_class)
+
+        if args.columnar:
+            path = os.path.join(COLUMNAR_DIR, args.set)
+            if not os.path.exists(path):
+                logger.error(f'{path} not found, run ./import_dataset.py --columnar')
+                return
+            candidates = columnar_candidates(ColumnarStore(path), classes, args)
+        else:
+            annotations_table = ANNOTATIONS[args.set]['table']
+            if not table_exists(conn, annotations_table):
+                annotations_table = None
+            candidates = class_candidates(conn, schema, classes, annotations_table, args)
+        image_ids, counts = sample_images(candidates, order, available, args, logger)
+
+    with ExitStack() as stack:
+        f = sys.stdout if args.output == '-' else stack.enter_context(open(args.output, 'w'))
+        f.writelines(f'{image_id}\n' for image_id in image_ids)
+
+    short = sum(1 for class_name, _, _ in class_stats if counts[class_name] < args.per_class)
+    logger.info(
+        f'[{args.set}] Sampled {len(image_ids)} images of {len(class_stats)} classes '
+        f'({short} with fewer than {args.per_class} images, max {max(counts.values(), default=0)} per class)'
+    )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        '--set',
+        type=str,
+        default='train',
+        choices=['train', 'validation', 'test'],
+        help='Set of data (train, validation or test)',
+    )
+    parser.add_argument(
+        '--classes',
+        type=str,
+        nargs='+',
+        help='List of classes to sample (e.g. Person "Human eye", defaults to all classes)',
+    )
+    parser.add_argument(
+        '--per-class',
+        type=int,
+        required=True,
+        help='Number of images to pick per class',
+    )
+    parser.add_argument(
+        '--cap',
+        type=int,
+        help='Skip images of classes that already have CAP images',
+    )
+    parser.add_argument(
+        '--min-box-size',
+        type=float,
+        default=0,
+        help='Only count boxes whose side, the square root of the relative area, is at least MIN_BOX_SIZE (0 to 1)',
+    )
+    parser.add_argument(
+        '--columnar',
+        action='store_true',
+        help='Read the images of each class from the columnar store of ./import_dataset.py --columnar',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default='-',
+        help='Path of the list of sampled image ids, the input of download_images.py --ids-file (- for stdout)',
+    )
+    parser.add_argument(
+        '-l', '--loglevel',
+        type=str.upper,
+        choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'],
+        default='INFO',
+    )
+
+    args = parser.parse_args()
+    if args.cap is not None and args.cap < args.per_class:
+        parser.error('--cap must be at least --per-class')
+    if not 0 <= args.min_box_size <= 1:
+        parser.error('--min-box-size must be between 0 and 1')
+    main(args)
@@ -1,74 +1,116 @@
 import os
 
-BASE_DIR = os.path.realpath(os.path.dirname(__file__))
+# OPEN_IMAGES_BASE_DIR points the scripts at another working directory (e.g. benchmark data)
+BASE_DIR = os.environ.get('OPEN_IMAGES_BASE_DIR') or os.path.realpath(os.path.dirname(__file__))
 DATASET_DIR = os.path.join(BASE_DIR, 'dataset')
+# OPEN_IMAGES_BASE_URL points download_dataset.py at a mirror or a local server
+DATASET_BASE_URL = os.environ.get('OPEN_IMAGES_BASE_URL') or 'https://storage.googleapis.com/openimages/2018_04'
 IMAGES_DIR = os.path.join(BASE_DIR, 'images')
 PREVIEWS_DIR = os.path.join(BASE_DIR, 'previews')
 LABELS_DIR = os.path.join(BASE_DIR, 'labels')
 
 DATASET_DB = os.path.join(BASE_DIR, 'dataset.sqlite')
+COLUMNAR_DIR = os.path.join(BASE_DIR, 'columnar')
+SHARDS_DIR = os.path.join(BASE_DIR, 'shards')
+URL_CACHE_DB = os.path.join(BASE_DIR, 'url_cache.sqlite')
+URL_CACHE_TTL = 30 * 24 * 60 * 60
+# Seconds to connect and between bytes read, so a stalled connection fails instead of blocking a worker
+HTTP_TIMEOUT = (10, 60)
+VERIFY_CACHE_DB = os.path.join(BASE_DIR, 'verify_cache.sqlite')
+IMAGE_CACHE_DIR = os.path.join(BASE_DIR, 'image_cache')
+IMAGE_CACHE_SIZE = 10 * 1024 ** 3
 
 DATASET = {
     'metadata': {
         'classes': {
             'table': 'classes',
             'local_path': os.path.join(DATASET_DIR, 'class-descriptions-boxable.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/class-descriptions-boxable.csv',
+            'remote_url': f'{DATASET_BASE_URL}/class-descriptions-boxable.csv',
         }
     },
     'bboxes': {
         'train': {
             'table': 'bboxes_train',
             'local_path': os.path.join(DATASET_DIR, 'train-annotations-bbox.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/train/train-annotations-bbox.csv',
+            'remote_url': f'{DATASET_BASE_URL}/train/train-annotations-bbox.csv',
         },
         'validation': {
             'table': 'bboxes_validation',
             'local_path': os.path.join(DATASET_DIR, 'validation-annotations-bbox.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/validation/validation-annotations-bbox.csv',
+            'remote_url': f'{DATASET_BASE_URL}/validation/validation-annotations-bbox.csv',
         },
         'test': {
             'table': 'bboxes_test',
             'local_path': os.path.join(DATASET_DIR, 'test-annotations-bbox.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/test/test-annotations-bbox.csv',
+            'remote_url': f'{DATASET_BASE_URL}/test/test-annotations-bbox.csv',
         },
     },
     'labels': {
         'train': {
             'table': 'labels_train',
             'local_path': os.path.join(DATASET_DIR, 'train-annotations-human-imagelabels-boxable.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/train/train-annotations-human-imagelabels-boxable.csv',
+            'remote_url': f'{DATASET_BASE_URL}/train/train-annotations-human-imagelabels-boxable.csv',
         },
         'validation': {
             'table': 'labels_validation',
             'local_path': os.path.join(DATASET_DIR, 'validation-annotations-human-imagelabels-boxable.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/validation/validation-annotations-human-imagelabels-boxable.csv',
+            'remote_url': f'{DATASET_BASE_URL}/validation/validation-annotations-human-imagelabels-boxable.csv',
         },
         'test': {
             'table': 'labels_test',
             'local_path': os.path.join(DATASET_DIR, 'test-annotations-human-imagelabels-boxable.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/test/test-annotations-human-imagelabels-boxable.csv',
+            'remote_url': f'{DATASET_BASE_URL}/test/test-annotations-human-imagelabels-boxable.csv',
         },
     },
     'images': {
         'train': {
             'table': 'images_train',
             'local_path': os.path.join(DATASET_DIR, 'train-images-boxable-with-rotation.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/train/train-images-boxable-with-rotation.csv',
+            'remote_url': f'{DATASET_BASE_URL}/train/train-images-boxable-with-rotation.csv',
         },
         'validation': {
             'table': 'images_validation',
             'local_path': os.path.join(DATASET_DIR, 'validation-images-with-rotation.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/validation/validation-images-with-rotation.csv',
+            'remote_url': f'{DATASET_BASE_URL}/validation/validation-images-with-rotation.csv',
         },
         'test': {
             'table': 'images_test',
             'local_path': os.path.join(DATASET_DIR, 'test-images-with-rotation.csv'),
-            'remote_url': 'https://storage.googleapis.com/openimages/2018_04/test/test-images-with-rotation.csv',
+            'remote_url': f'{DATASET_BASE_URL}/test/test-images-with-rotation.csv',
         },
     },
 }
 
+ANNOTATIONS = {
+    'train': {
+        'table': 'annotations_train',
+    },
+    'validation': {
+        'table': 'annotations_validation',
+    },
+    'test': {
+        'table': 'annotations_test',
+    },
+}
+
+CLASS_STATS = {
+    'train': {
+        'classes': 'class_stats_train',
+        'pairs': 'class_pairs_train',
+        'box_sizes': 'class_box_sizes_train',
+    },
+    'validation': {
+        'classes': 'class_stats_validation',
+        'pairs': 'class_pairs_validation',
+        'box_sizes': 'class_box_sizes_validation',
+    },
+    'test': {
+        'classes': 'class_stats_test',
+        'pairs': 'class_pairs_test',
+        'box_sizes': 'class_box_sizes_test',
+    },
+}
+
 BBOX_COLORS = [
     (  0, 255, 255),
     (255,   0, 255),
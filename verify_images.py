@@ -1,20 +1,129 @@
 #!/usr/bin/env python
 
 import argparse
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
 import sys
+from collections import Counter
+from contextlib import closing, ExitStack
+from itertools import islice
 
-import cv2
+from lib import logging, metrics, sql_schema, table_exists
+from lib.verify import verify_image, VerifyCache
+from settings import DATASET, DATASET_DB, VERIFY_CACHE_DB
 
-from lib import logging
+IMAGE_ID_PATTERN = re.compile(r'^[0-9a-f]{16}$')
+
+
+def iter_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def iter_batches(items, batch_size):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def lookup_md5s(conn, images_tables, paths):
+    image_ids = {}
+    for path in paths:
+        image_id = os.path.splitext(os.path.basename(path))[0]
+        if IMAGE_ID_PATTERN.match(image_id):
+            image_ids[path] = image_id
+    if conn is None or not image_ids:
+        return {}
+
+    schema = sql_schema(conn)
+    md5s = {}
+    for table in images_tables:
+        query, params = schema.select_image_md5s(table, sorted(set(image_ids.values())))
+        for image_id, original_size, original_md5 in conn.execute(query, params):
+            md5s[image_id] = original_size, original_md5
+    return {path: md5s[image_id] for path, image_id in image_ids.items() if image_id in md5s}
 
 
 def main(args):
     logger = logging.getLogger(__name__)
     logger.setLevel(args.loglevel)
 
-    for image_path in args.images:
-        print(image_path, file=sys.stderr, flush=True)
-        cv2.imread(image_path)
+    sets = [args.set] if args.set else DATASET['images'].keys()
+
+    with ExitStack() as stack:
+        conn = None
+        images_tables = []
+        if not args.without_md5 and os.path.exists(DATASET_DB):
+            conn = stack.enter_context(closing(sqlite3.connect(DATASET_DB)))
+            images_tables = [
+                DATASET['images'][s]['table'] for s in sets if table_exists(conn, DATASET['images'][s]['table'])
+            ]
+        cache = None if args.without_cache else stack.enter_context(closing(VerifyCache(VERIFY_CACHE_DB)))
+        report = sys.stdout if args.report == '-' else stack.enter_context(open(args.report, 'w'))
+        pool = stack.enter_context(multiprocessing.Pool(args.workers))
+        stack.enter_context(metrics.reporter('verify_images', args, logger))
+
+        counts = Counter()
+
+        def record(path, size, mtime, status, error, cached=False):
+            counts[status] += 1
+            metrics.inc(f'images_{status}')
+            # Only full verifications are cached
+            if cache is not None and not cached and size is not None and not (args.markers_only and status == 'ok'):
+                cache.set(path, size, mtime, status, error)
+            if status == 'ok':
+                logger.debug('%s ok', path)
+            else:
+                logger.debug('%s %s: %s', path, status, error)
+                report.write(json.dumps({'path': path, 'status': status, 'error': error}) + '\n')
+
+        for batch in iter_batches(iter_paths(args.images), args.batch_size):
+            pending = []
+            for path in batch:
+                try:
+                    stat = os.stat(path)
+                except OSError as e:
+                    record(path, None, None, 'missing', str(e))
+                    continue
+
+                row = cache.get(path, stat.st_size, stat.st_mtime) if cache is not None else None
+                if row:
+                    counts['cached'] += 1
+                    metrics.inc('images_cached')
+                    record(path, stat.st_size, stat.st_mtime, *row, cached=True)
+                else:
+                    pending.append(path)
+
+            with metrics.timer('sql_md5_lookup'):
+                md5s = lookup_md5s(conn, images_tables, pending)
+            tasks = [(path, *md5s.get(path, (None, None)), not args.markers_only) for path in pending]
+            with metrics.timer('verify_batch'):
+                for result in pool.imap_unordered(verify_image, tasks, chunksize=16):
+                    record(*result)
+
+            if cache is not None:
+                cache.commit()
+            report.flush()
+            logger.info(
+                f'Checked {sum(counts[status] for status in counts if status != "cached")} images '
+                f'({counts["cached"]} cached): '
+                + ', '.join(f'{status} {count}' for status, count in sorted(counts.items()) if status != 'cached')
+            )
+
+    failures = sum(count for status, count in counts.items() if status not in ('ok', 'cached'))
+    return 1 if failures else 0
 
 
 if __name__ == '__main__':
@@ -24,7 +133,49 @@ if __name__ == '__main__':
         'images',
         type=str,
         nargs='+',
+        help='Image files or directories to verify',
+    )
+    parser.add_argument(
+        '--set',
+        type=str,
+        default=None,
+        choices=['train', 'validation', 'test'],
+        help='Set of data to look up original MD5s in (defaults to all sets)',
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count(),
+        help='Number of processes verifying images in parallel',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=1000,
+        help='Number of images looked up and verified per batch',
+    )
+    parser.add_argument(
+        '--report',
+        type=str,
+        default='-',
+        help='Path of the JSON lines report of corrupt and missing images (- for stdout)',
+    )
+    parser.add_argument(
+        '--markers-only',
+        action='store_true',
+        help='Check only the start and end markers without decoding images',
+    )
+    parser.add_argument(
+        '--without-md5',
+        action='store_true',
+        help='Do not compare MD5s against images.original_md5',
+    )
+    parser.add_argument(
+        '--without-cache',
+        action='store_true',
+        help='Verify all images, ignoring and not updating the verify cache',
     )
+    metrics.add_arguments(parser)
     parser.add_argument(
         '-l', '--loglevel',
         type=str.upper,
@@ -32,4 +183,4 @@ if __name__ == '__main__':
         default='INFO',
     )
 
-    main(parser.parse_args())
+    sys.exit(main(parser.parse_args()))